@@ -0,0 +1,154 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# compress.py - compression of large RPC payloads
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# Both sides of a kaa.rpc connection negotiate the compression methods
+# they support. If compression is used, a large argument or return value
+# is pickled, compressed with zlib and sent as Compressed object. The
+# receiver calls unwrap on every value that may be compressed. The bytes
+# before and after compression and the CPU time are counted in stats.
+#
+# -----------------------------------------------------------------------------
+# TVServer - A generic TV device wrapper and scheduler
+# Copyright (C) 2009 Dirk Meyer, et al.
+#
+# First Edition: Dirk Meyer <dischi@freevo.org>
+# Maintainer:    Dirk Meyer <dischi@freevo.org>
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'Compressed', 'Compressor', 'METHODS', 'negotiate', 'wrap', 'unwrap', 'stats' ]
+
+# python imports
+import time
+import zlib
+import cPickle
+
+# supported compression methods, the first is the preferred one
+METHODS = [ 'zlib' ]
+
+# values smaller than this number of bytes are not compressed
+THRESHOLD = 4096
+
+# zlib compression level
+LEVEL = 6
+
+# bytes compressed in one Compressor step
+BLOCK_SIZE = 64 * 1024
+
+# compressed values, bytes before and after compression and the CPU
+# time in seconds for compression and decompression
+stats = {
+    'compressed': 0,
+    'raw_bytes': 0,
+    'compressed_bytes': 0,
+    'compress_time': 0.0,
+    'decompress_time': 0.0
+}
+
+class Compressed(object):
+    """
+    Compressed pickled value
+    """
+    def __init__(self, method, data):
+        self.method = method
+        self.data = data
+
+
+def negotiate(methods):
+    """
+    Return the first supported method of the given list or None
+    """
+    for method in METHODS:
+        if method in (methods or []):
+            return method
+    return None
+
+def wrap(value, method):
+    """
+    Return the value as Compressed object if the method is set and the
+    pickled value is large enough, otherwise return the value itself.
+    """
+    compressor = Compressor(value, method)
+    while not compressor.step():
+        pass
+    return compressor.result
+
+
+class Compressor(object):
+    """
+    Incremental wrap, the value is compressed in blocks of BLOCK_SIZE
+    bytes. Call step until it returns True, the result of wrap is in the
+    result attribute then.
+    """
+    def __init__(self, value, method):
+        self.result = value
+        self._method = method
+        self._data = None
+        self._pos = 0
+        if not method:
+            return
+        t0 = time.time()
+        data = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+        stats['compress_time'] += time.time() - t0
+        if len(data) < THRESHOLD:
+            return
+        self._data = data
+        self._zlib = zlib.compressobj(LEVEL)
+        self._compressed = []
+
+    def step(self):
+        """
+        Compress the next block, returns True when done
+        """
+        if self._data is None:
+            return True
+        t0 = time.time()
+        data = self._data
+        self._compressed.append(self._zlib.compress(data[self._pos:self._pos+BLOCK_SIZE]))
+        self._pos += BLOCK_SIZE
+        if self._pos < len(data):
+            stats['compress_time'] += time.time() - t0
+            return False
+        self._compressed.append(self._zlib.flush())
+        compressed = ''.join(self._compressed)
+        stats['compress_time'] += time.time() - t0
+        self._data = self._compressed = self._zlib = None
+        if len(compressed) < len(data):
+            stats['compressed'] += 1
+            stats['raw_bytes'] += len(data)
+            stats['compressed_bytes'] += len(compressed)
+            self.result = Compressed(self._method, compressed)
+        return True
+
+
+def unwrap(value):
+    """
+    Return the original value of a Compressed object or the value itself
+    """
+    if not isinstance(value, Compressed):
+        return value
+    if value.method != 'zlib':
+        raise ValueError('unsupported compression %s' % value.method)
+    t0 = time.time()
+    value = cPickle.loads(zlib.decompress(value.data))
+    stats['decompress_time'] += time.time() - t0
+    return value
@@ -39,10 +39,85 @@ import kaa
 
 # tvdev imports
 from template import PluginTemplate
+from ..xmltv import Parser
 
 # get logging object
 log = logging.getLogger('tvserver.device.dvbstreamer')
 
+# time in seconds to stay on a multiplex to receive the EIT
+SCAN_TIME = 60
+# minimum and maximum time between two scans of a multiplex
+SCAN_INTERVAL_MIN = 60 * 60
+SCAN_INTERVAL_MAX = 12 * 60 * 60
+
+class Scanner(object):
+    """
+    EPG scan coordinator for all dvbstreamer tuners. It knows when each
+    multiplex was scanned and if the EIT changed in the last scan. An idle
+    tuner gets the stalest multiplex not scanned by another tuner, so all
+    tuners split the multiplexes between them. Multiplexes with an
+    unchanged EIT are scanned less often.
+    """
+    def __init__(self):
+        # multiplex key to [ last scan, eit version, scan interval ]
+        self.multiplexes = {}
+        # multiplex key to tuner currently scanning it
+        self.claims = {}
+
+    def register(self, keys):
+        """
+        Register the multiplexes of a tuner
+        """
+        for key in keys:
+            self.multiplexes.setdefault(key, [ 0, None, SCAN_INTERVAL_MIN ])
+
+    def next(self, tuner, keys):
+        """
+        Return the stalest multiplex from the given keys and claim it for
+        the tuner. Returns None if no multiplex needs a scan.
+        """
+        now = time.time()
+        best = None
+        for key in keys:
+            if key in self.claims:
+                continue
+            last, version, interval = self.multiplexes[key]
+            staleness = (now - last) / interval
+            if staleness >= 1 and (best is None or staleness > best[0]):
+                best = staleness, key
+        if best is None:
+            return None
+        self.claims[best[1]] = tuner
+        return best[1]
+
+    def scanned(self, key):
+        """
+        The scan of the multiplex is done
+        """
+        self.claims.pop(key, None)
+        self.multiplexes[key][0] = time.time()
+
+    def release(self, key):
+        """
+        The scan of the multiplex was aborted
+        """
+        self.claims.pop(key, None)
+
+    def update(self, key, version):
+        """
+        Set the EIT version of the multiplex after an EPG dump
+        """
+        state = self.multiplexes.get(key)
+        if not state:
+            return
+        if state[1] == version:
+            state[2] = min(state[2] * 2, SCAN_INTERVAL_MAX)
+        else:
+            state[2] = SCAN_INTERVAL_MIN
+        state[1] = version
+
+_scanner = Scanner()
+
 
 class Plugin(PluginTemplate):
 
@@ -53,6 +128,7 @@ class Plugin(PluginTemplate):
         log.debug('new controller: adapter=%s' % config.adapter)
         self._data = ''
         self._callback = None
+        self._parser = None
         self._requests = []
         self.dvbstreamer = kaa.Process('dvbstreamer')
         self.dvbstreamer.signals['read'].connect(self._read)
@@ -61,9 +137,14 @@ class Plugin(PluginTemplate):
         self._ready = False
         self._busy = True
         self._current_multiplex = None
-        self._dvbstreamer_init()
-        self._epg_counter = -1
+        # multiplex key to the service id used to select it
+        self._scan_multiplexes = {}
+        self._scanning = None
+        # multiplexes scanned by this tuner since the last epg dump
+        self._scanned = set()
+        self._epg_pending = False
         self._recordings = 0
+        self._dvbstreamer_init()
 
     @kaa.coroutine()
     def _dvbstreamer_init(self):
@@ -111,57 +192,104 @@ class Plugin(PluginTemplate):
                 mplex[service['Multiplex UID']] = []
             mplex[service['Multiplex UID']].append(service['Name'])
             self.channels[service['Name']] = service
+            self._scan_multiplexes.setdefault(self._multiplex_key(service), service['ID'])
         self.multiplexes = mplex.values()
+        _scanner.register(self._scan_multiplexes.keys())
         self.initialized = True
         self.idle()
 
+    def _multiplex_key(self, service):
+        """
+        Return the multiplex key of the service, it is the same for all
+        tuners: network id and transport stream id.
+        """
+        return '.'.join(service['ID'].split('.')[:2])
+
     def _dvbstreamer_died(self, data):
         log.info('dvbstreamer stopped')
         self._current_multiplex = None
 
     def _read(self, data):
         self._data += data
+        if self._parser:
+            # stream the result to the parser and only keep enough
+            # data to detect the prompt
+            pos = self._data.find('DVBStreamer>')
+            if pos < 0:
+                pos = max(len(self._data) - 11, 0)
+            try:
+                self._parser.feed(self._data[:pos])
+            except Exception, e:
+                log.exception('unable to parse data')
+                self._parser = None
+            self._data = self._data[pos:]
         if self._data.find('DVBStreamer>') >= 0:
             result = self._data[:self._data.find('DVBStreamer>')]
             if self._callback:
                 self._callback.finish(result)
                 self._callback = None
+            self._parser = None
             if self._requests:
-                cmd, self._callback = self._requests.pop(0)
+                cmd, self._callback, self._parser = self._requests.pop(0)
                 self.dvbstreamer.write(cmd)
             else:
                 self._ready = True
             self._data = self._data[self._data.find('DVBStreamer>')+12:]
 
-    @kaa.timed(60)
+    def _idle_window(self):
+        """
+        Return True if the tuner is free for the next scan
+        """
+        if self._recordings:
+            return False
+        now = time.time()
+        for schedule in self.schedules.values():
+            if schedule.stop > now and schedule.start < now + 2 * SCAN_TIME:
+                return False
+        return True
+
+    @kaa.timed(SCAN_TIME)
     def idle(self):
-        self._epg_counter += 1
-        if self._epg_counter < 0:
-            # no need to scan again, check tuner status
-            if not self._recordings and self.dvbstreamer.running and not self.dvbstreamer.stopping:
-                if self._busy:
-                    # mark as not busy
-                    self._busy = False
-                else:
-                    # shut down dvbstreamer, we do not need it
-                    log.info('shut down dvbstreamer')
-                    self.dvbstreamer.stop()
+        if self._scanning:
+            # the multiplex was selected long enough to receive the EIT
+            _scanner.scanned(self._scanning)
+            self._scanned.add(self._scanning)
+            self._scanning = None
+            self._epg_pending = True
+        if not self._idle_window():
+            # busy, wait for the next call
             return
-        if self._recordings:
-            # busy, wait a minute
-            self._epg_counter = -1
+        key = _scanner.next(self, self._scan_multiplexes.keys())
+        if key:
+            log.info('scan multiplex %s', key)
+            self._scanning = key
+            channel = self._scan_multiplexes[key]
+            for service in self.channels.values():
+                if service['ID'] == channel:
+                    self._current_multiplex = service['Multiplex UID']
+            self._call('select %s' % channel)
             return
-        if self._epg_counter >= len(self.multiplexes):
-            # scan again in 3 hours
+        if self._epg_pending:
+            # all stale multiplexes are scanned, send epg
+            self._epg_pending = False
             self.signals['epg-update'].emit()
-            self._epg_counter = - 3 * 60
             return
-        channel = self.channels[self.multiplexes[self._epg_counter][0]]
-        self._current_multiplex = channel['Multiplex UID']
-        self._call('select %s' % channel['ID'])
+        # no need to scan, check tuner status
+        if self.dvbstreamer.running and not self.dvbstreamer.stopping:
+            if self._busy:
+                # mark as not busy
+                self._busy = False
+            else:
+                # shut down dvbstreamer, we do not need it
+                log.info('shut down dvbstreamer')
+                self.dvbstreamer.stop()
 
     @kaa.coroutine()
-    def _call(self, cmd):
+    def _call(self, cmd, parser=None):
+        """
+        Send a command to dvbstreamer. If a parser is given, the result is
+        fed to the parser as it arrives and not returned.
+        """
         self._busy = True
         log.debug('cmd %s', cmd)
         if self.dvbstreamer.stopping:
@@ -175,15 +303,20 @@ class Plugin(PluginTemplate):
         if self._ready:
             self._ready = False
             self._callback = async
+            self._parser = parser
             self.dvbstreamer.write(cmd + '\n')
         else:
-            self._requests.append((cmd + '\n', async))
+            self._requests.append((cmd + '\n', async, parser))
         yield (yield async)
 
     @kaa.coroutine()
     def start(self, channel, url):
         scheduling_id = str(uuid.uuid4())
         channel = self.channels[channel]
+        if self._scanning:
+            # abort epg scan
+            _scanner.release(self._scanning)
+            self._scanning = None
         # switch to new multiplex and service
         if self._current_multiplex != channel['Multiplex UID']:
             self._current_multiplex = channel['Multiplex UID']
@@ -203,5 +336,23 @@ class Plugin(PluginTemplate):
         yield self._call('rmsf %s' % id)
 
     @kaa.coroutine()
-    def epg(self):
-        yield 'xmltv', (yield self._call('dumpxmltv'))
+    def epg(self, callback):
+        # the dump contains all multiplexes dvbstreamer ever scanned, only
+        # the versions of the ones scanned by this tuner since the last
+        # dump are up to date.
+        scanned, self._scanned = self._scanned, set()
+        # the hash of all programs of a multiplex is its EIT version
+        versions = {}
+        def add_program(program):
+            service = self.channels.get(parser.channels.get(program[0]))
+            if service:
+                key = self._multiplex_key(service)
+                versions[key] = hash((versions.get(key), program))
+            callback(program)
+        parser = Parser(add_program)
+        yield self._call('dumpxmltv', parser)
+        parser.close()
+        for key, version in versions.items():
+            if key in scanned:
+                _scanner.update(key, version)
+        yield parser.channels
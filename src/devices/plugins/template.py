@@ -194,6 +194,18 @@ class PluginTemplate(object):
         """
         raise NotImplemented
 
+    def epg(self, callback):
+        """
+        Get the EPG from the device. This function must be implemented by
+        plugins with the epg capability. The callback is called for each
+        program with a tuple of channel id, start, stop, title, subtitle,
+        episode and description.
+
+        @param callback: function to call for each program
+        @returns dict of channel id to channel name or InProgress object
+        """
+        raise NotImplemented
+
     @property
     def priority(self):
         return int(self.config.priority)
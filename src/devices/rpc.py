@@ -34,6 +34,8 @@ import os
 import socket
 import logging
 import time
+import tempfile
+import cPickle
 
 # kaa imports
 import kaa
@@ -41,16 +43,154 @@ import kaa.rpc
 
 # tvdev imports
 from system import config, get_devices
+from .. import compress
+from .. import metrics
 
 # get logging object
 log = logging.getLogger('tvserver')
 
+# number of programs in one epg chunk sent to the tvserver
+EPG_CHUNK_SIZE = 500
+
+# maximum number of epg chunks sent and not acknowledged by the tvserver.
+# The parser can not be stopped, further chunks are spooled to a
+# temporary file to keep them out of the memory.
+EPG_WINDOW = 4
+
+class EPGUpload(object):
+    """
+    Chunked epg upload to the tvserver. The programs of each channel are
+    hashed and channels unchanged since the last acknowledged upload are
+    not sent again.
+    """
+    def __init__(self, channel, id, hashes, compression=None):
+        self.channel = channel
+        self.id = id
+        self.compression = compression
+        self.count = 0
+        self.programs = []
+        # chunks sent and not acknowledged
+        self.pending = []
+        # file with the chunks waiting for the window, its read position
+        # and the number of chunks in it
+        self._spool = None
+        self._spool_pos = 0
+        self._spooled = 0
+        # failed epg_chunk call
+        self._failed = None
+        # hashes from the last acknowledged upload and for this upload
+        self.hashes = hashes
+        self.new_hashes = {}
+        # programs of the current channel
+        self._run = []
+        self._run_channel = None
+
+    def add(self, program):
+        """
+        Add a program to the upload
+        """
+        if program[0] != self._run_channel:
+            self._add_run()
+            self._run_channel = program[0]
+        self._run.append(program)
+
+    def _add_run(self):
+        """
+        Add the programs of the current channel if they changed
+        """
+        if not self._run:
+            return
+        run, self._run = self._run, []
+        if self._run_channel in self.new_hashes:
+            # programs of this channel are not in one block, the hash
+            # can not be used.
+            self.new_hashes[self._run_channel] = None
+        else:
+            self.new_hashes[self._run_channel] = hash(tuple(run))
+            if self.hashes.get(self._run_channel) == self.new_hashes[self._run_channel]:
+                # unchanged since the last upload
+                return
+        self.programs.extend(run)
+        if len(self.programs) >= EPG_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Send the programs as next chunk
+        """
+        if not self.programs:
+            return
+        data = compress.wrap(self.programs, self.compression)
+        self.programs = []
+        if self._failed:
+            return
+        if len(self.pending) < EPG_WINDOW and not self._spooled:
+            self._send(data)
+            return
+        if self._spool is None:
+            self._spool = tempfile.TemporaryFile(prefix='tvdev-epg-')
+        self._spool.seek(0, 2)
+        cPickle.dump(data, self._spool, cPickle.HIGHEST_PROTOCOL)
+        self._spooled += 1
+
+    def _send(self, data):
+        """
+        Send the data as next chunk
+        """
+        ip = self.channel.rpc('epg_chunk', self.id, self.count, data)
+        self.pending.append(ip)
+        self.count += 1
+        ip.connect_both(lambda result: self._acknowledged(ip), lambda *args: self._error(ip))
+
+    def _acknowledged(self, ip):
+        """
+        Callback when the tvserver acknowledged a chunk
+        """
+        self.pending.remove(ip)
+        while self._spooled and len(self.pending) < EPG_WINDOW and not self._failed:
+            self._spool.seek(self._spool_pos)
+            data = cPickle.load(self._spool)
+            self._spool_pos = self._spool.tell()
+            self._spooled -= 1
+            self._send(data)
+
+    def _error(self, ip):
+        """
+        Callback when a chunk failed, no more chunks are sent
+        """
+        self.pending.remove(ip)
+        self._failed = ip
+        self._spooled = 0
+        if self._spool:
+            self._spool.close()
+            self._spool = None
+
+    @kaa.coroutine()
+    def finish(self, channels):
+        """
+        Send the remaining programs and finish the upload. Returns the
+        hashes of this upload once the tvserver acknowledged it.
+        """
+        self._add_run()
+        self.flush()
+        while self.pending:
+            yield self.pending[0]
+        if self._failed:
+            # raises the exception of the failed call
+            yield self._failed
+        if self._spool:
+            self._spool.close()
+        yield self.channel.rpc('epg_end', self.id, self.count, channels)
+        yield self.new_hashes
+
 class RPCDevice(object):
     """
     Controller for kaa.rpc.
     """
     def __init__(self, device, address, password):
         self.device = device
+        # name of the peer in the rpc metrics
+        self.name = device.name
         self.device.signals['started'].connect(self.started)
         self.device.signals['stopped'].connect(self.stopped)
         self.device.signals['epg-update'].connect(self.epg_update)
@@ -58,9 +198,26 @@ class RPCDevice(object):
         self.channel.register(self)
         self.channel.signals['open'].connect(self._connected)
         self.channel.signals['closed'].connect(self._disconnected)
+        # hashes of the programs per channel in the last epg upload
+        self._epg_hashes = {}
+        # compression negotiated with the tvserver
+        self._compression = None
 
     def _connected(self):
         log.info('connected to tvserver')
+        # the tvserver may be a new one, send the complete epg
+        self._epg_hashes = {}
+        self._compression = None
+
+    @kaa.rpc.expose()
+    @metrics.measure
+    def capabilities(self, capabilities):
+        """
+        Negotiate the capabilities of the connection with the tvserver
+        """
+        self._compression = compress.negotiate(capabilities.get('compression'))
+        log.info('use %s compression', self._compression)
+        return { 'compression': self._compression }
 
     def _disconnected(self):
         log.info('disconnected from tvserver')
@@ -68,15 +225,18 @@ class RPCDevice(object):
         # to make sure the tvserver has a none state.
 
     @kaa.rpc.expose()
+    @metrics.measure
     def identify(self):
         name = '%s:%s' % (socket.gethostname(), self.device.name)
         return name, self.device.priority, self.device.multiplexes, self.device.capabilities
 
     @kaa.rpc.expose()
+    @metrics.measure
     def schedule(self, channel, start, stop, url):
         return self.device.schedule(channel, start, stop, url)
 
     @kaa.rpc.expose()
+    @metrics.measure
     def create_fxd(self, filename, content):
         if filename.startswith('file:'):
             filename = filename[5:]
@@ -85,9 +245,17 @@ class RPCDevice(object):
         open(os.path.join(config.directory, filename), 'w').write(content)
 
     @kaa.rpc.expose()
+    @metrics.measure
     def remove(self, id):
         return self.device.remove(id)
 
+    @kaa.rpc.expose()
+    def stats(self):
+        """
+        Return the call metrics of the exposed methods of all devices
+        """
+        return metrics.get_stats()
+
     def started(self, id):
         if not self.channel.status == kaa.rpc.CONNECTED:
             log.warning('device not connected')
@@ -105,10 +273,14 @@ class RPCDevice(object):
         if not self.channel.status == kaa.rpc.CONNECTED:
             log.warning('device not connected')
             yield None
-        epg = self.device.epg()
-        if isinstance(epg, kaa.InProgress):
-            epg = yield epg
-        self.channel.rpc('epg', epg)
+        # stream the programs in chunks to the tvserver while the
+        # device parses its epg.
+        id = yield self.channel.rpc('epg_begin', 'programs')
+        upload = EPGUpload(self.channel, id, self._epg_hashes, self._compression)
+        channels = self.device.epg(upload.add)
+        if isinstance(channels, kaa.InProgress):
+            channels = yield channels
+        self._epg_hashes = yield upload.finish(channels)
 
 # load all devices
 _devices = []
@@ -120,4 +292,5 @@ def connect(address, password):
     """
     for device in (yield get_devices()):
         _devices.append(RPCDevice(device, address, password))
+    metrics.start_logging()
     yield _devices is not []
@@ -0,0 +1,123 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# xmltv.py - incremental XMLTV parser
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# The parser is fed with the XMLTV data as it arrives and calls the callback
+# for each program. A program is a tuple of channel id, start, stop, title,
+# subtitle, episode and description with start and stop in seconds since
+# Epoch (UTC). Only the channels are kept in memory.
+#
+# -----------------------------------------------------------------------------
+# TVServer - A generic TV device wrapper and scheduler
+# Copyright (C) 2009 Dirk Meyer, et al.
+#
+# First Edition: Dirk Meyer <dischi@freevo.org>
+# Maintainer:    Dirk Meyer <dischi@freevo.org>
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'Parser' ]
+
+# python imports
+import time
+import calendar
+import logging
+import xml.parsers.expat
+
+# get logging object
+log = logging.getLogger('tvdev')
+
+# program elements stored in the tuple
+_PROGRAM_ELEMENTS = ('title', 'sub-title', 'episode-num', 'desc')
+
+def _parse_time(value):
+    """
+    Convert XMLTV time (e.g. 20090120190000 +0100) to seconds since Epoch
+    """
+    if not value:
+        return 0
+    value = value.split()
+    t = calendar.timegm(time.strptime(value[0][:14], '%Y%m%d%H%M%S'))
+    if len(value) > 1 and len(value[1]) == 5:
+        offset = int(value[1][1:3]) * 3600 + int(value[1][3:5]) * 60
+        if value[1][0] == '-':
+            offset = -offset
+        t -= offset
+    return t
+
+
+class Parser(object):
+    """
+    Incremental XMLTV parser
+    """
+    def __init__(self, callback):
+        self.callback = callback
+        # channel id to display name
+        self.channels = {}
+        self._parser = xml.parsers.expat.ParserCreate()
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._text
+        self._current = None
+        self._data = []
+
+    def feed(self, data):
+        """
+        Parse the next part of the XMLTV data
+        """
+        self._parser.Parse(data, False)
+
+    def close(self):
+        """
+        Finish parsing
+        """
+        self._parser.Parse('', True)
+
+    def _start(self, name, attrs):
+        if name == 'channel':
+            self._current = { 'id': attrs.get('id') }
+        elif name == 'programme':
+            self._current = { 'channel': attrs.get('channel'),
+                              'start': _parse_time(attrs.get('start')),
+                              'stop': _parse_time(attrs.get('stop')) }
+        self._data = []
+
+    def _text(self, data):
+        self._data.append(data)
+
+    def _end(self, name):
+        if self._current is None:
+            return
+        if name == 'channel':
+            self.channels[self._current['id']] = self._current.get('display-name', self._current['id'])
+            self._current = None
+        elif name == 'programme':
+            p = self._current
+            self._current = None
+            try:
+                self.callback((p['channel'], p['start'], p['stop'], p.get('title', u''),
+                    p.get('sub-title', u''), p.get('episode-num', u''), p.get('desc', u'')))
+            except Exception, e:
+                log.exception('xmltv callback')
+        elif name == 'display-name' or name in _PROGRAM_ELEMENTS:
+            # only use the first element, e.g. the first language
+            self._current.setdefault(name, u''.join(self._data).strip())
+        self._data = []
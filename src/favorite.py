@@ -86,7 +86,7 @@ class Favorites(list):
         for f in favorites:
             for localf in self:
                 if localf.id == f[0]:
-                    favorites.remove(localf)
+                    list.remove(self, localf)
                     break
             self.append(Favorite(self._link, *f))
 
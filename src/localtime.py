@@ -0,0 +1,224 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# localtime.py - fast UTC to local time conversion
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# The local timezone offsets and the DST transitions are calculated once
+# for the time between one year ago and two years ahead. Each conversion
+# is a bisect in that table. Timestamps outside that range fall back to
+# time.localtime. If numpy is installed, the functions working on arrays
+# of timestamps convert all values at once.
+#
+# -----------------------------------------------------------------------------
+# TVServer - A generic TV device wrapper and scheduler
+# Copyright (C) 2009 Dirk Meyer, et al.
+#
+# First Edition: Dirk Meyer <dischi@freevo.org>
+# Maintainer:    Dirk Meyer <dischi@freevo.org>
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'utcoffset', 'weekday', 'minute_of_day', 'minute_of_week', 'strftime',
+            'datetime', 'utcoffsets', 'weekdays', 'minutes_of_day', 'minutes_of_week',
+            'reset' ]
+
+# python imports
+import time
+import bisect
+import calendar
+import datetime as _datetime
+
+# numpy is optional and only needed for the array functions
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DAY = 24 * 60 * 60
+
+class _FixedOffset(_datetime.tzinfo):
+    """
+    tzinfo with a fixed offset to UTC
+    """
+    def __init__(self, offset, name):
+        self._offset = _datetime.timedelta(seconds=offset)
+        self._name = name
+
+    def utcoffset(self, dt):
+        return self._offset
+
+    def dst(self, dt):
+        return _datetime.timedelta(0)
+
+    def tzname(self, dt):
+        return self._name
+
+
+class _Table(object):
+    """
+    Table of the local timezone offsets to UTC with the time of each
+    DST transition.
+    """
+    def __init__(self):
+        now = int(time.time())
+        self.start = now - 366 * DAY
+        self.stop = now + 2 * 366 * DAY
+        self.transitions = [ self.start ]
+        self.offsets = [ _utcoffset(self.start) ]
+        self.isdst = [ _isdst(self.start) ]
+        t = self.start
+        while t < self.stop:
+            next = t + DAY
+            if _utcoffset(next) != self.offsets[-1]:
+                # find the exact second of the transition
+                lo, hi = t, next
+                while hi - lo > 1:
+                    mid = (lo + hi) / 2
+                    if _utcoffset(mid) == self.offsets[-1]:
+                        lo = mid
+                    else:
+                        hi = mid
+                self.transitions.append(hi)
+                self.offsets.append(_utcoffset(hi))
+                self.isdst.append(_isdst(hi))
+            t = next
+        self.tzinfo = {}
+        if numpy is not None:
+            self.np_transitions = numpy.array(self.transitions, dtype=numpy.int64)
+            self.np_offsets = numpy.array(self.offsets, dtype=numpy.int64)
+
+    def lookup(self, t):
+        """
+        Return offset and dst flag for the timestamp
+        """
+        if self.start <= t < self.stop:
+            pos = bisect.bisect_right(self.transitions, t) - 1
+            return self.offsets[pos], self.isdst[pos]
+        return _utcoffset(t), _isdst(t)
+
+
+def _utcoffset(t):
+    return calendar.timegm(time.localtime(t)) - int(t)
+
+def _isdst(t):
+    return max(time.localtime(t)[8], 0)
+
+_table = None
+
+def _get_table():
+    """
+    Return the cached table, it is created again once a year.
+    """
+    global _table
+    if _table is None or time.time() > _table.stop - 366 * DAY:
+        _table = _Table()
+    return _table
+
+def reset():
+    """
+    Drop the cached table, e.g. after the timezone changed.
+    """
+    global _table
+    _table = None
+
+def utcoffset(t):
+    """
+    Return the offset of the local time to UTC in seconds
+    """
+    return _get_table().lookup(int(t))[0]
+
+def weekday(t):
+    """
+    Return the local weekday with 0 = Sunday - 6 = Saturday (strftime %w)
+    """
+    t = int(t) + utcoffset(t)
+    return (t / DAY + 4) % 7
+
+def minute_of_day(t):
+    """
+    Return the local minute of the day
+    """
+    t = int(t) + utcoffset(t)
+    return (t % DAY) / 60
+
+def minute_of_week(t):
+    """
+    Return the local minute of the week starting Sunday 00:00
+    """
+    t = int(t) + utcoffset(t)
+    return ((t / DAY + 4) % 7) * 1440 + (t % DAY) / 60
+
+def strftime(format, t):
+    """
+    Format the timestamp as local time with time.strftime. The %z and %Z
+    directives are supported.
+    """
+    offset, isdst = _get_table().lookup(int(t))
+    if format.find('%z') >= 0:
+        sign = '+'
+        if offset < 0:
+            sign = '-'
+        format = format.replace('%z', '%s%02d%02d' % (sign, abs(offset) / 3600, abs(offset) / 60 % 60))
+    if format.find('%Z') >= 0:
+        format = format.replace('%Z', time.tzname[isdst])
+    return time.strftime(format, time.gmtime(int(t) + offset))
+
+def datetime(t):
+    """
+    Return a timezone-aware datetime object in local time
+    """
+    table = _get_table()
+    offset, isdst = table.lookup(int(t))
+    if not (offset, isdst) in table.tzinfo:
+        table.tzinfo[(offset, isdst)] = _FixedOffset(offset, time.tzname[isdst])
+    tzinfo = table.tzinfo[(offset, isdst)]
+    return _datetime.datetime.utcfromtimestamp(t + offset).replace(tzinfo=tzinfo)
+
+def utcoffsets(timestamps):
+    """
+    Return the offsets of the local time to UTC for a numpy array of
+    timestamps. Timestamps outside the table use the nearest offset.
+    """
+    table = _get_table()
+    timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+    pos = numpy.searchsorted(table.np_transitions, timestamps, side='right') - 1
+    return table.np_offsets[pos.clip(0)]
+
+def weekdays(timestamps):
+    """
+    Return the local weekdays for a numpy array of timestamps
+    """
+    timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+    return ((timestamps + utcoffsets(timestamps)) // DAY + 4) % 7
+
+def minutes_of_day(timestamps):
+    """
+    Return the local minutes of the day for a numpy array of timestamps
+    """
+    timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+    return ((timestamps + utcoffsets(timestamps)) % DAY) // 60
+
+def minutes_of_week(timestamps):
+    """
+    Return the local minutes of the week for a numpy array of timestamps
+    """
+    timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+    timestamps = timestamps + utcoffsets(timestamps)
+    return ((timestamps // DAY + 4) % 7) * 1440 + (timestamps % DAY) // 60
@@ -0,0 +1,233 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# metrics.py - call metrics of the exposed RPC methods
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# The measure decorator counts the calls and errors of an exposed method
+# for each peer, sums the payload size and adds the latency to a
+# histogram with fixed buckets. For methods returning an InProgress
+# object the latency is the time until it is finished. The payload size
+# is the length of all string and compressed arguments and results,
+# other values are not serialized just to measure them; for lists,
+# tuples and dicts the number of items is counted instead. The peer is
+# the client of methods exposed with add_client=True or the name of the
+# object, e.g. the device. The metrics of a disconnected client are
+# folded into the CLOSED peer.
+#
+# -----------------------------------------------------------------------------
+# TVServer - A generic TV device wrapper and scheduler
+# Copyright (C) 2009 Dirk Meyer, et al.
+#
+# First Edition: Dirk Meyer <dischi@freevo.org>
+# Maintainer:    Dirk Meyer <dischi@freevo.org>
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'measure', 'measure_client', 'forget', 'get_stats', 'start_logging', 'BUCKETS', 'CLOSED' ]
+
+# python imports
+import time
+import bisect
+import logging
+import functools
+
+# kaa imports
+import kaa
+import kaa.rpc
+
+# tvserver imports
+from compress import Compressed
+
+# get logging object
+log = logging.getLogger('tvserver')
+
+# upper bounds of the latency histogram buckets in seconds, the last
+# bucket counts all calls slower than the last bound
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+class Metric(object):
+    """
+    Metrics of one method and peer
+    """
+    __slots__ = ('calls', 'errors', 'bytes', 'items', 'time', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes = 0
+        self.items = 0
+        self.time = 0.0
+        self.histogram = [ 0 ] * (len(BUCKETS) + 1)
+
+    def add(self, latency, size, error):
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.bytes += size[0]
+        self.items += size[1]
+        self.time += latency
+        self.histogram[bisect.bisect_left(BUCKETS, latency)] += 1
+
+    def merge(self, metric):
+        """
+        Add the counters of the given metric
+        """
+        self.calls += metric.calls
+        self.errors += metric.errors
+        self.bytes += metric.bytes
+        self.items += metric.items
+        self.time += metric.time
+        for pos, n in enumerate(metric.histogram):
+            self.histogram[pos] += n
+
+    def percentile(self, p):
+        """
+        Return the upper bound of the bucket containing the percentile
+        """
+        count = 0
+        for pos, n in enumerate(self.histogram):
+            count += n
+            if count >= self.calls * p:
+                if pos < len(BUCKETS):
+                    return BUCKETS[pos]
+                break
+        return None
+
+# (method, peer) to Metric
+_metrics = {}
+
+# peer the metrics of disconnected clients are folded into
+CLOSED = 'closed'
+
+def _size(value):
+    """
+    Return (bytes, items) of an argument or result. Only strings and
+    Compressed values have a byte size known without pickling them
+    again; this covers the compressed sync, snapshot and query replies
+    and the EPG chunks. For lists, tuples and dicts the number of items
+    is counted instead, other values (ints, None, small objects) count
+    as zero.
+    """
+    if isinstance(value, basestring):
+        return len(value), 0
+    if isinstance(value, Compressed):
+        return len(value.data), 0
+    if isinstance(value, (list, tuple, dict)):
+        return 0, len(value)
+    return 0, 0
+
+def _add(a, b):
+    return a[0] + b[0], a[1] + b[1]
+
+def _peer(obj, args):
+    """
+    Return the name of the peer: the client for methods exposed with
+    add_client or the name of the object (e.g. the device).
+    """
+    if args and isinstance(args[0], kaa.rpc.Channel):
+        return str(args[0])
+    return getattr(obj, 'name', '-')
+
+def measure(func):
+    """
+    Decorator to measure an exposed method. It must be placed below the
+    kaa.rpc.expose decorator.
+    """
+    name = func.__name__
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        key = name, _peer(self, args)
+        metric = _metrics.get(key)
+        if metric is None:
+            metric = _metrics[key] = Metric()
+        size = 0, 0
+        for arg in args:
+            size = _add(size, _size(arg))
+        t0 = time.time()
+        try:
+            result = func(self, *args, **kwargs)
+        except:
+            metric.add(time.time() - t0, size, True)
+            raise
+        if isinstance(result, kaa.InProgress) and not result.finished:
+            result.connect_both(
+                lambda value: metric.add(time.time() - t0, _add(size, _size(value)), False),
+                lambda *exc: metric.add(time.time() - t0, size, True))
+        else:
+            metric.add(time.time() - t0, _add(size, _size(result)), False)
+        return result
+    return wrapper
+
+def measure_client(func):
+    """
+    Decorator like measure for methods exposed with add_client=True only
+    to use the client as peer. The client is not passed to the method.
+    """
+    def call(self, client, *args, **kwargs):
+        return func(self, *args, **kwargs)
+    call.__name__ = func.__name__
+    return functools.wraps(func)(measure(call))
+
+def forget(peer):
+    """
+    Fold the metrics of a disconnected peer into the CLOSED peer. This
+    keeps the totals without one entry per client ever connected.
+    """
+    for method, p in _metrics.keys():
+        if p == peer:
+            total = _metrics.get((method, CLOSED))
+            if total is None:
+                total = _metrics[(method, CLOSED)] = Metric()
+            total.merge(_metrics.pop((method, p)))
+
+def get_stats():
+    """
+    Return the metrics as list of (method, peer, calls, errors, bytes,
+    items, time, histogram) with the histogram using the BUCKETS bounds.
+    """
+    return [ (method, peer, m.calls, m.errors, m.bytes, m.items, m.time, m.histogram[:])
+             for (method, peer), m in sorted(_metrics.items()) ]
+
+def log_summary():
+    """
+    Log the metrics of all methods summed over the peers
+    """
+    methods = {}
+    for (method, peer), m in _metrics.items():
+        total = methods.get(method)
+        if total is None:
+            total = methods[method] = Metric()
+        total.merge(m)
+    if not methods:
+        return True
+    info = 'rpc metrics:\n'
+    for method, m in sorted(methods.items()):
+        p95 = m.percentile(0.95)
+        info += '%-24s %6d calls %4d errors %10d bytes %8d items %8.2f ms avg %s ms p95\n' % \
+                (method, m.calls, m.errors, m.bytes, m.items, m.time * 1000 / max(m.calls, 1),
+                 p95 is None and '>%d' % (BUCKETS[-1] * 1000) or int(p95 * 1000))
+    log.info(info.rstrip())
+    return True
+
+def start_logging(interval=300):
+    """
+    Log the summary every interval seconds
+    """
+    kaa.Timer(log_summary).start(interval)
@@ -31,12 +31,11 @@
 
 __all__ = [ 'Recording', 'Recordings' ]
 
-# python imports
-from datetime import datetime
-
 # kaa imports
 import kaa
-import kaa.dateutils
+
+# tvserver imports
+import localtime
 
 class Recording(object):
     """
@@ -53,8 +52,8 @@ class Recording(object):
         self.id, self.name, self.channel, self.priority, self.start_timestamp, self.stop_timestamp, \
                  self.status, self.start_padding, self.stop_padding, self.description = args
         # Timezone-aware datetime objects in the local timezone.
-        self.start = datetime.fromtimestamp(self.start_timestamp, kaa.dateutils.local)
-        self.stop = datetime.fromtimestamp(self.stop_timestamp, kaa.dateutils.local)
+        self.start = localtime.datetime(self.start_timestamp)
+        self.stop = localtime.datetime(self.stop_timestamp)
 
     def remove(self):
         """
@@ -100,27 +99,39 @@ class Recordings(object):
     def __init__(self, link):
         self._link = link
         self._recordings = {}
+        # recording id to key in self._recordings
+        self._keys = {}
 
     def _clear(self):
         """
         Clear the list
         """
         self._recordings = {}
+        self._keys = {}
 
     def _update(self, recordings):
         """
         Update list of recordings based on event from tvserver
         """
         for r in recordings:
-            for key, v in self._recordings.items():
-                if v.id == r[0]:
-                    localr = self._recordings.pop(key)
-                    localr._update(*r)
-                    break
+            localr = None
+            if r[0] in self._keys:
+                localr = self._recordings.pop(self._keys.pop(r[0]), None)
+            if localr is not None:
+                localr._update(*r)
             else:
                 localr = Recording(self._link, *r)
             key = '%s-%s-%s' % (localr.channel, localr.start, localr.stop)
             self._recordings[key] = localr
+            self._keys[localr.id] = key
+
+    def _remove(self, ids):
+        """
+        Remove recordings based on event from tvserver
+        """
+        for id in ids:
+            if id in self._keys:
+                self._recordings.pop(self._keys.pop(id), None)
 
     def __iter__(self):
         """
@@ -32,6 +32,7 @@
 # python imports
 import logging
 import time
+import cPickle
 
 # kaa imports
 import kaa
@@ -41,6 +42,8 @@ import kaa.epg
 # tvserver imports
 from recording import Recordings
 from favorite import Favorites
+import wire
+import compress
 
 # get logging object
 log = logging.getLogger('tvserver')
@@ -51,6 +54,17 @@ class TVServer(object):
         self.signals = kaa.Signals('connected', 'disconnected', 'changed')
         self.recordings = Recordings(self)
         self.favorites = Favorites(self)
+        # epoch and version of the recordings, the version is None
+        # while syncing or before the first sync
+        self._epoch = None
+        self._version = None
+        # list of (name, priority, number of channels, number of
+        # recordings) for each device of the server
+        self.devices = []
+        # subscription arguments, None for all updates
+        self._subscription = None
+        # encoding of the recordings negotiated with the server
+        self._encoding = 'tuple'
         self.channel = kaa.rpc.connect(address, password, retry=1)
         self.channel.register(self)
         self.channel.signals['open'].connect(self._connected)
@@ -62,14 +76,79 @@ class TVServer(object):
     @kaa.coroutine()
     def _connected(self, *args):
         log.info('connected to tvserver')
-        self.recordings._update((yield self.channel.rpc('recording_list')))
-        self.favorites._update((yield self.channel.rpc('favorite_list')))
+        # the reply arrives before the snapshot, old servers without
+        # capabilities use the tuple encoding
+        self._encoding = 'tuple'
+        capabilities = { 'encodings': wire.ENCODINGS, 'compression': compress.METHODS }
+        self.channel.rpc('capabilities', capabilities).connect_both(self._capabilities, self._capabilities_failed)
+        if self._subscription:
+            self.channel.rpc('subscribe', **self._subscription)
+        yield self._snapshot()
         self.signals['connected'].emit()
 
+    def _capabilities(self, capabilities):
+        """
+        Callback with the capabilities of the connection
+        """
+        self._encoding = capabilities.get('encoding', 'tuple')
+
+    def _capabilities_failed(self, *args):
+        log.info('server does not support capabilities')
+
+    @kaa.coroutine()
+    def _snapshot(self):
+        """
+        Get the recordings changed since the last version, the favorites
+        and the devices from the server.
+        """
+        args = self._sync_version()
+        snapshot = compress.unwrap((yield self.channel.rpc('snapshot', *args)))
+        if snapshot.get('encoding') == 'compact':
+            recordings = wire.decode_recordings(snapshot['recordings'], 'compact')
+        else:
+            recordings = wire.decode(snapshot['recordings'], wire.RECORDING_INTERNED)
+        self._apply(snapshot['epoch'], snapshot['version'], snapshot['full'],
+                    recordings, snapshot['deletes'])
+        self.favorites._clear()
+        self.favorites._update(wire.decode(snapshot['favorites']))
+        self.devices = snapshot['devices']
+
+    def _sync_version(self):
+        """
+        Return the arguments to sync from the current version and mark
+        the client as syncing.
+        """
+        args = ()
+        if self._version is not None:
+            args = self._epoch, self._version
+        self._version = None
+        return args
+
+    @kaa.coroutine()
+    def _sync(self):
+        """
+        Get the recordings changed since the last version from the
+        server or all recordings if the server does not know the version.
+        """
+        args = self._sync_version()
+        epoch, version, full, upserts, deletes = \
+               compress.unwrap((yield self.channel.rpc('recording_sync', *args)))
+        self._apply(epoch, version, full, wire.decode_recordings(upserts, self._encoding), deletes)
+
+    def _apply(self, epoch, version, full, upserts, deletes):
+        """
+        Apply the result of a sync
+        """
+        if full:
+            self.recordings._clear()
+        self.recordings._update(upserts)
+        self.recordings._remove(deletes)
+        self._epoch, self._version = epoch, version
+
     def _disconnected(self):
         self.signals['disconnected'].emit()
         log.info('disconnected from tvserver')
-        self.recordings._clear()
+        # keep the recordings and the version to resume on reconnect
         self.favorites._clear()
 
     @property
@@ -148,16 +227,142 @@ class TVServer(object):
             raise RuntimeError('not connected to tvserver')
         return self.channel.rpc('favorite_remove', id, **kwargs)
 
+    @kaa.coroutine()
+    def subscribe(self, start=None, stop=None, channels=None, statuses=None, favorites=True):
+        """
+        Subscribe to a part of the recordings. The server only sends
+        updates for recordings matching all given arguments.
+
+        @param start: only recordings stopping after start
+        @param stop: only recordings starting before stop
+        @param channels: list of channel names
+        @param statuses: list of status values, e.g. [ 'scheduled' ]
+        @param favorites: False to receive no favorite updates
+        @returns: InProgress object
+        """
+        if not self.connected:
+            raise RuntimeError('not connected to tvserver')
+        self._subscription = dict(start=start, stop=stop, channels=channels,
+                                  statuses=statuses, favorites=favorites)
+        self.channel.rpc('subscribe', **self._subscription)
+        # the recordings known are not valid for the new subscription
+        self._epoch = self._version = None
+        yield self._sync()
+        self.signals['changed'].emit()
+
+    @kaa.coroutine()
+    def recording_query(self, cursor=None, limit=100, **filters):
+        """
+        Get one page of recordings from the server
+
+        @param cursor: cursor returned for the previous page
+        @param limit: maximum number of recordings
+        @param filters: start, stop, channels, statuses, favorite_id, text
+        @returns: InProgress object with the recordings as lists and the
+            cursor for the next page or None
+        """
+        if not self.connected:
+            raise RuntimeError('not connected to tvserver')
+        recordings, cursor = \
+                    compress.unwrap((yield self.channel.rpc('recording_query', cursor, limit, **filters)))
+        yield wire.decode_recordings(recordings, self._encoding), cursor
+
+    def recording_count(self, **filters):
+        """
+        Get the number of recordings matching the filters of recording_query
+        """
+        if not self.connected:
+            raise RuntimeError('not connected to tvserver')
+        return self.channel.rpc('recording_count', **filters)
+
+    def favorite_query(self, cursor=None, limit=100, text=None, channel=None):
+        """
+        Get one page of favorites from the server
+
+        @param cursor: cursor returned for the previous page
+        @param limit: maximum number of favorites
+        @param text: text in the name of the favorite
+        @param channel: channel of the favorite
+        @returns: InProgress object with the favorites as lists and the
+            cursor for the next page or None
+        """
+        if not self.connected:
+            raise RuntimeError('not connected to tvserver')
+        return self.channel.rpc('favorite_query', cursor, limit, text, channel)
+
+    def favorite_count(self, text=None, channel=None):
+        """
+        Get the number of favorites matching the text and channel
+        """
+        if not self.connected:
+            raise RuntimeError('not connected to tvserver')
+        return self.channel.rpc('favorite_count', text, channel)
+
+    def title_search(self, text):
+        """
+        Return all EPG titles containing the text
+
+        @param text: text to search, the case is ignored
+        """
+        if not self.connected:
+            raise RuntimeError('not connected to tvserver')
+        return self.channel.rpc('epg_title_search', text)
+
     @kaa.rpc.expose()
     def identify(self):
         return 'client'
 
+    @kaa.rpc.expose('packed')
+    def _packed(self, name, data):
+        """
+        Message from the server broadcast, the arguments are pickled
+        """
+        data = compress.unwrap(data)
+        if name == 'recording_update':
+            return self._recording_update(*cPickle.loads(data))
+        if name == 'favorite_update':
+            return self._favorite_update(*cPickle.loads(data))
+        log.error('unknown message %s', name)
+
+    @kaa.rpc.expose('resync')
+    def _resync(self):
+        """
+        The server dropped updates for this client
+        """
+        log.info('updates dropped by the server, sync again')
+        self._snapshot().connect(lambda *args: self.signals['changed'].emit())
+
     @kaa.rpc.expose('recording_update')
-    def _recording_update(self, *recordings):
-        self.recordings._update(recordings)
+    def _recording_update(self, *args):
+        if not args or isinstance(args[0], (list, tuple)):
+            # recordings in the format for clients without capabilities,
+            # sent before the negotiation. The snapshot contains them.
+            return
+        self._apply_update(*args)
+
+    def _apply_update(self, version, upserts, deletes, since=None):
+        """
+        Apply the recording update to the recordings
+        """
+        if self._version is None:
+            # syncing, the sync result contains this update
+            return
+        if version <= self._version:
+            return
+        if since is None:
+            # update without subscription, no version skipped
+            since = version - 1
+        if since != self._version:
+            log.info('missed recording update after %s, sync again', self._version)
+            self._sync().connect(lambda *args: self.signals['changed'].emit())
+            return
+        self.recordings._update(wire.decode_recordings(upserts, self._encoding))
+        self.recordings._remove(deletes)
+        self._version = version
         self.signals['changed'].emit()
 
     @kaa.rpc.expose('favorite_update')
     def _favorite_update(self, *fav):
-        self.recordings._update(fav)
+        self.favorites._clear()
+        self.favorites._update(fav)
         self.signals['changed'].emit()
@@ -0,0 +1,159 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# broadcast.py - send updates to all clients
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# Updates for the clients are collected for a short time and merged into
+# one message. The message is pickled once and the same string is sent
+# to all clients with the same subscription using the packed RPC of the
+# client. Only clients with a filtered subscription get their own
+# message. The message is compressed for clients supporting it.
+#
+# -----------------------------------------------------------------------------
+# TVServer - A generic TV device wrapper and scheduler
+# Copyright (C) 2009 Dirk Meyer, et al.
+#
+# First Edition: Dirk Meyer <dischi@freevo.org>
+# Maintainer:    Dirk Meyer <dischi@freevo.org>
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'Broadcast', 'pack' ]
+
+# python imports
+import cPickle
+import logging
+
+# kaa imports
+import kaa
+
+# tvserver imports
+from .. import wire
+from .. import compress
+
+# get logging object
+log = logging.getLogger('tvserver')
+
+# time in seconds to collect updates
+BATCH_DELAY = 0.05
+
+def pack(*args):
+    """
+    Pickle the arguments of a message
+    """
+    return cPickle.dumps(args, cPickle.HIGHEST_PROTOCOL)
+
+
+class Broadcast(object):
+    """
+    Collect updates and send them to the clients
+    """
+    def __init__(self, clients):
+        # the list of Client objects, changed by the server
+        self.clients = clients
+        # recording changes as (version, upserts, deletes)
+        self._recordings = []
+        # the list of favorites
+        self._favorites = None
+
+    def recordings(self, version, upserts, deletes):
+        """
+        Add the changes of a recording version
+        """
+        self._recordings.append((version, upserts, deletes))
+        self._flush_later()
+
+    def favorites(self, favorites):
+        """
+        Set the new list of favorites
+        """
+        self._favorites = favorites
+        self._flush_later()
+
+    @kaa.timed(BATCH_DELAY, kaa.OneShotTimer, policy=kaa.POLICY_ONCE)
+    def _flush_later(self):
+        self.flush()
+
+    def _merge(self):
+        """
+        Merge the collected recording versions
+        """
+        upserts = {}
+        deletes = set()
+        for version, u, d in self._recordings:
+            for listing in u:
+                upserts[listing[0]] = listing
+                deletes.discard(listing[0])
+            for id in d:
+                upserts.pop(id, None)
+                deletes.add(id)
+        version = self._recordings[-1][0]
+        self._recordings = []
+        return version, upserts.values(), list(deletes)
+
+    def flush(self):
+        """
+        Send all collected updates now
+        """
+        if self._recordings:
+            version, upserts, deletes = self._merge()
+            # messages for clients without filter, the key is the
+            # version the client had before and the encoding
+            packed = {}
+            sent = 0
+            for c in self.clients:
+                if c.legacy:
+                    # the old protocol has no versions and no removals
+                    if upserts and c.send('recording_update', upserts):
+                        sent += 1
+                    continue
+                if c.version is None or c.syncing:
+                    # not synced yet or the sync reply is built, the
+                    # sync starts again if the version changed
+                    continue
+                if c.filtered:
+                    u, d = c.filter(upserts, deletes)
+                    if not u and not d:
+                        continue
+                    data = pack(version, wire.encode_recordings(u, c.encoding), d, c.version)
+                    data = compress.wrap(data, c.compression)
+                else:
+                    key = c.version, c.encoding, c.compression
+                    if not key in packed:
+                        data = pack(version, wire.encode_recordings(upserts, c.encoding),
+                                    deletes, c.version)
+                        packed[key] = compress.wrap(data, c.compression)
+                    data = packed[key]
+                if c.send('recording_update', data):
+                    c.version = version
+                    sent += 1
+            log.info('send update %s for %s recordings, %s removed to %s of %s clients',
+                     version, len(upserts), len(deletes), sent, len(self.clients))
+        if self._favorites is not None:
+            data = pack(*self._favorites)
+            packed = {}
+            for c in self.clients:
+                if c.legacy:
+                    c.send('favorite_update', self._favorites)
+                elif c.favorites:
+                    if not c.compression in packed:
+                        packed[c.compression] = compress.wrap(data, c.compression)
+                    c.send('favorite_update', packed[c.compression])
+            self._favorites = None
@@ -0,0 +1,114 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# changelog.py - versioned recording changes for the clients
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# The server keeps a hash of each recording sent to the clients. After
+# each change the hashes are compared with the recordings, a new version
+# is created with the recordings added or modified (upserts) and the ids
+# of the recordings removed (deletes). A client applies the versions in
+# order and syncs again if it misses one.
+#
+# The last versions are kept in a bounded log. A client reconnecting
+# with its epoch and version only gets the changes since that version.
+# If the version is not in the log anymore or the server was restarted
+# (new epoch), the client gets all recordings.
+#
+# -----------------------------------------------------------------------------
+# TVServer - A generic TV device wrapper and scheduler
+# Copyright (C) 2009 Dirk Meyer, et al.
+#
+# First Edition: Dirk Meyer <dischi@freevo.org>
+# Maintainer:    Dirk Meyer <dischi@freevo.org>
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'ChangeLog' ]
+
+# python imports
+import time
+import collections
+
+# number of versions kept in the log
+LOG_SIZE = 200
+
+def _fingerprint(listing):
+    """
+    Return a hash of a recording list from Recording.to_list
+    """
+    return hash(listing[:-1] + (tuple(sorted(listing[-1].items())),))
+
+
+class ChangeLog(object):
+    """
+    Versioned changes of the recordings
+    """
+    def __init__(self, size=LOG_SIZE):
+        # the epoch changes on server restart, the versions start again
+        self.epoch = int(time.time())
+        self.version = 0
+        # recording id to hash of the last version
+        self._hashes = {}
+        # the last versions as (version, upserts, deletes)
+        self._log = collections.deque(maxlen=size)
+
+    def update(self, recordings):
+        """
+        Compare the recordings with the last version. If something
+        changed, a new version is created and (version, upserts, deletes)
+        returned, None otherwise.
+        """
+        hashes = {}
+        upserts = []
+        for r in recordings:
+            listing = r.to_list()
+            hashes[r.id] = _fingerprint(listing)
+            if self._hashes.get(r.id) != hashes[r.id]:
+                upserts.append(listing)
+        deletes = [ id for id in self._hashes if not id in hashes ]
+        self._hashes = hashes
+        if not upserts and not deletes:
+            return None
+        self.version += 1
+        self._log.append((self.version, upserts, deletes))
+        return self.version, upserts, deletes
+
+    def since(self, epoch, version):
+        """
+        Return (upserts, deletes) with all changes after the given
+        version or None if the version is not in the log.
+        """
+        if epoch != self.epoch or version > self.version:
+            return None
+        if version < self.version and (not self._log or self._log[0][0] > version + 1):
+            # too old
+            return None
+        upserts = {}
+        deletes = set()
+        for v, u, d in self._log:
+            if v <= version:
+                continue
+            for listing in u:
+                upserts[listing[0]] = listing
+                deletes.discard(listing[0])
+            for id in d:
+                upserts.pop(id, None)
+                deletes.add(id)
+        return upserts.values(), list(deletes)
@@ -0,0 +1,212 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# client.py - connected client with its subscription
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# A client can subscribe to a part of the recordings: a time window, a
+# set of channels and a set of status values. Recording updates not
+# matching the subscription are not sent. A recording the client knows
+# that does not match anymore is sent as removed. Favorite updates can
+# be turned off.
+#
+# Each client has a bounded send queue. Only a few messages are sent
+# without a reply from the client, the other messages wait in the queue.
+# If the queue is full, all waiting updates are dropped and the client
+# gets no further updates. After the client answered all messages sent,
+# it is told to sync again with one snapshot call.
+#
+# -----------------------------------------------------------------------------
+# TVServer - A generic TV device wrapper and scheduler
+# Copyright (C) 2009 Dirk Meyer, et al.
+#
+# First Edition: Dirk Meyer <dischi@freevo.org>
+# Maintainer:    Dirk Meyer <dischi@freevo.org>
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'Client' ]
+
+# python imports
+import collections
+import logging
+
+# get logging object
+log = logging.getLogger('tvserver')
+
+# number of messages sent without a reply from the client
+WINDOW = 4
+# number of messages waiting to be sent
+QUEUE_SIZE = 32
+
+class Client(object):
+    """
+    Client connected to the server
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        # last recording version sent to the client
+        self.version = None
+        # flag if a sync reply is built, updates are not sent meanwhile
+        self.syncing = False
+        # encoding of the recordings, see wire.ENCODINGS
+        self.encoding = 'tuple'
+        # compression method, see compress.METHODS
+        self.compression = None
+        # the client did not negotiate the capabilities. It only knows
+        # recording_update and favorite_update with the recording and
+        # favorite lists as arguments and can not sync again.
+        self.legacy = True
+        # messages waiting and the number of messages sent without reply
+        self.queue = collections.deque()
+        self.inflight = 0
+        # flag if updates were dropped and the client must sync again
+        self.resync = False
+        # counters for the stats
+        self.sent = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.subscribe()
+
+    def subscribe(self, start=None, stop=None, channels=None, statuses=None, favorites=True):
+        """
+        Set the subscription. Only recordings running between start and
+        stop on one of the channels with one of the status values are
+        sent. None matches everything.
+        """
+        self.start = start
+        self.stop = stop
+        # an empty list matches no recording
+        self.channels = self.statuses = None
+        if channels is not None:
+            self.channels = set(channels)
+        if statuses is not None:
+            self.statuses = set(statuses)
+        self.favorites = favorites
+        self.filtered = start is not None or stop is not None or \
+                        channels is not None or statuses is not None
+        # ids of the recordings the client knows
+        self.ids = set()
+
+    def match(self, listing):
+        """
+        Check if the recording from Recording.to_list is subscribed
+        """
+        id, name, channel, priority, start, stop, status = listing[:7]
+        if self.start is not None and stop <= self.start:
+            return False
+        if self.stop is not None and start >= self.stop:
+            return False
+        if self.channels is not None and not channel in self.channels:
+            return False
+        if self.statuses is not None and not status in self.statuses:
+            return False
+        return True
+
+    def filter(self, upserts, deletes):
+        """
+        Return the upserts and deletes for the client
+        """
+        if not self.filtered:
+            return upserts, deletes
+        client_upserts = []
+        client_deletes = []
+        for listing in upserts:
+            if self.match(listing):
+                client_upserts.append(listing)
+                self.ids.add(listing[0])
+            elif listing[0] in self.ids:
+                client_deletes.append(listing[0])
+                self.ids.remove(listing[0])
+        for id in deletes:
+            if id in self.ids:
+                client_deletes.append(id)
+                self.ids.remove(id)
+        return client_upserts, client_deletes
+
+    def synced(self, version, full, upserts, deletes):
+        """
+        Return the filtered result of a sync to the client
+        """
+        if full:
+            self.ids = set()
+        upserts, deletes = self.filter(upserts, deletes)
+        self.version = version
+        return upserts, deletes
+
+    def send(self, name, data):
+        """
+        Send a message pickled by broadcast.pack or the list of arguments
+        for legacy clients. Returns False if the message was dropped.
+        """
+        if self.resync:
+            self.dropped += 1
+            return False
+        if self.inflight < WINDOW:
+            self._write(name, data)
+            return True
+        if len(self.queue) < QUEUE_SIZE:
+            self.queue.append((name, data))
+            return True
+        # the client is too slow, drop all updates and sync again
+        log.warning('send queue of %s full, drop %s updates', self.channel, len(self.queue) + 1)
+        self.dropped += len(self.queue) + 1
+        self.queue.clear()
+        self.resync = True
+        # no recording updates until the client synced again
+        self.version = None
+        return False
+
+    def _write(self, name, data):
+        self.inflight += 1
+        self.sent += 1
+        if self.legacy:
+            self.channel.rpc(name, *data).connect_both(self._written, self._written)
+        else:
+            self.channel.rpc('packed', name, data).connect_both(self._written, self._written)
+
+    def _written(self, *args):
+        """
+        Callback when the client replied to a message
+        """
+        self.inflight -= 1
+        if self.queue:
+            self._write(*self.queue.popleft())
+        elif self.resync and not self.inflight:
+            self.resync = False
+            if self.legacy:
+                # the dropped updates are lost for the client
+                log.info('send queue of %s empty, continue with updates', self.channel)
+                return
+            log.info('send queue of %s empty, sync again', self.channel)
+            self.resyncs += 1
+            self.channel.rpc('resync')
+
+    def stats(self):
+        """
+        Return a dict with the send queue metrics
+        """
+        return {
+            'queue': len(self.queue),
+            'inflight': self.inflight,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'resyncs': self.resyncs,
+            'resync': self.resync
+        }
@@ -37,6 +37,7 @@ import os
 import sys
 import time
 import logging
+import functools
 
 # kaa imports
 import kaa
@@ -57,6 +58,34 @@ log = logging.getLogger('tvserver')
 # (only next hour, update every 30 minutes)
 SCHEDULE_TIMER = 60 * 60
 
+def single_flight(func):
+    """
+    Decorator for coroutine methods without arguments. A call while the
+    method is running returns the InProgress object of the current run
+    and the method is called once more after the run finished, no matter
+    how many calls arrived in the meantime.
+    """
+    name = func.__name__
+    @functools.wraps(func)
+    def newfunc(self):
+        if name in self._flights:
+            # run once more with the changes since the current run started
+            self._flights[name][1] = True
+            return self._flights[name][0]
+        async = func(self)
+        if async.finished:
+            return async
+        flight = self._flights[name] = [ async, False ]
+        def finished(*args):
+            del self._flights[name]
+            if flight[1]:
+                # call the method of the object, it may be overloaded
+                getattr(self, name)()
+        async.connect_both(finished, finished)
+        return async
+    return newfunc
+
+
 class Controller(object):
     """
     Class for the tvserver.
@@ -64,13 +93,19 @@ class Controller(object):
     def __init__(self, datafile):
         epg.init()
         self.locked = False
+        # running single_flight methods
+        self._flights = {}
         self.datafile = datafile
+        # flag if EPG or device changes wait for the next reschedule
+        self._pending_reschedule = False
         # load the recordings file
         self.load_schedule()
+        epg.update_favorites(self.favorites)
         # connect to recorder signals
         device.signals['start-recording'].connect(self._recorder_start)
         device.signals['stop-recording'].connect(self._recorder_stop)
-        device.signals['changed'].connect(self.reschedule)
+        device.signals['changed'].connect(self._changed)
+        epg.signals['changed'].connect(self._changed)
         # start by checking the recordings/favorites
         self.check_favorites_and_reschedule()
         # add schedule timer for SCHEDULE_TIMER / 3 seconds
@@ -106,15 +141,15 @@ class Controller(object):
         log.info(info)
         return True
 
+    @single_flight
     @kaa.coroutine()
     def reschedule(self):
         """
         Reschedule all recordings.
         """
-        if self.locked:
-            # system busy, call again later
-            kaa.OneShotTimer(self.reschedule).start(0.1)
-            yield False
+        while self.locked:
+            # system busy, try again later
+            yield kaa.delay(0.1)
         self.locked = True
         # get current time (UTC)
         ctime = int(time.time())
@@ -135,21 +170,48 @@ class Controller(object):
         self.locked = False
         yield True
 
+    @single_flight
     @kaa.coroutine()
     def check_favorites_and_reschedule(self):
         """
         Update recordings based on favorites and epg.
         """
-        if self.locked:
-            # system busy, call again later
-            kaa.OneShotTimer(self.check_favorites_and_reschedule).start(0.1)
-            yield False
+        while self.locked:
+            # system busy, try again later
+            yield kaa.delay(0.1)
         self.locked = True
         yield epg.check(self.recordings, self.favorites)
+        # one shot favorites may be removed
+        self._align_favorites()
         self.locked = False
-        self.reschedule()
+        self._changed()
         yield True
 
+    def _changed(self, recordings=[]):
+        """
+        Collect EPG and device changes. All changes of one cycle are
+        handled with one reschedule of all recordings, the changed
+        recordings from the signal are not needed for it.
+        """
+        self._pending_reschedule = True
+        self._reschedule_pending()
+
+    @kaa.timed(0.1, kaa.OneShotTimer, policy=kaa.POLICY_ONCE)
+    def _reschedule_pending(self):
+        """
+        Reschedule for all collected changes
+        """
+        if self.locked:
+            # system busy, call again later
+            self._reschedule_pending()
+            return False
+        if not self._pending_reschedule:
+            return False
+        log.info('reschedule for collected changes')
+        self._pending_reschedule = False
+        self.reschedule()
+        return True
+
     #
     # load / save schedule file with recordings and favorites
     #
@@ -160,6 +222,8 @@ class Controller(object):
         """
         self.recordings = []
         self.favorites = []
+        # saved favorite id to favorite
+        saved = {}
         if not os.path.isfile(self.datafile):
             return
         try:
@@ -191,6 +255,10 @@ class Controller(object):
                     log.exception('tvserver.load_favorite:')
                     continue
                 self.favorites.append(f)
+                if getattr(child, 'id', None) is not None:
+                    saved[int(child.id)] = f
+        # the recordings refer to the saved favorite ids
+        self._align_favorites(saved)
 
     @kaa.timed(1, kaa.OneShotTimer, policy=kaa.POLICY_RESTART)
     def save_schedule(self):
@@ -248,6 +316,7 @@ class Controller(object):
             if r.status == DELETED:
                 r.status = CONFLICT
                 r.favorite = False
+                r.favorite_id = None
                 # update schedule, this will also send an update to all
                 # clients registered.
                 self.reschedule()
@@ -303,6 +372,9 @@ class Controller(object):
         """
         updates favorites with data from the database
         """
+        # the caller may have updated the epg through kaa.epg, match the
+        # changed programs even if no modification was noticed yet
+        epg.changed()
         return self.check_favorites_and_reschedule()
 
     def favorite_add(self, name, channels, priority, days, times, once, substring):
@@ -314,11 +386,8 @@ class Controller(object):
         if f in self.favorites:
             return NameError('Already scheduled')
         self.favorites.append(f)
-        # Align favorites id(s)
-        next = 0
-        for r in self.favorites:
-            r.id = next
-            next += 1
+        self._align_favorites()
+        epg.update_favorites(self.favorites, [ f ])
         # update schedule
         self.check_favorites_and_reschedule()
 
@@ -333,11 +402,24 @@ class Controller(object):
             return NameError('Favorite not found!')
         log.info('favorite.remove: %s', f)
         self.favorites.remove(f)
-        # align favorites id(s)
-        next = 0
-        for r in self.favorites:
-            r.id = next
-            next += 1
+        self._align_favorites()
+        epg.update_favorites(self.favorites, [])
+
+    def _align_favorites(self, ids=None):
+        """
+        Number the favorites from 0 in list order and update the favorite
+        ids of the recordings. ids maps the old ids to the favorites, the
+        default are the current ids. Recordings of favorites not in the
+        list anymore lose their favorite id.
+        """
+        if ids is None:
+            ids = dict([ (f.id, f) for f in self.favorites ])
+        positions = dict([ (id(f), pos) for pos, f in enumerate(self.favorites) ])
+        for r in self.recordings:
+            if r.favorite_id is not None:
+                r.favorite_id = positions.get(id(ids.get(r.favorite_id)))
+        for pos, f in enumerate(self.favorites):
+            f.id = pos
 
     def favorite_modify(self, id, **kwargs):
         """
@@ -352,6 +434,8 @@ class Controller(object):
         cp = copy.copy(self.favorites[id])
         for key, value in kwargs.items():
             setattr(cp, key, value)
+        cp.compile()
         self.favorites[self.favorites.index(r)] = cp
+        epg.update_favorites(self.favorites, [ cp ])
         # update schedule
         self.check_favorites_and_reschedule()
@@ -39,10 +39,13 @@ import logging
 # kaa imports
 import kaa
 import kaa.epg
+import kaa.xmlutils
 from kaa.utils import property
 
 # record imports
 from config import config
+import epg
+import timeline
 
 # get logging object
 log = logging.getLogger('tvserver')
@@ -56,6 +59,13 @@ signals = { 'changed': kaa.Signal(),
 _devices = []
 _channel = {}
 
+# normalized EPG channel name to EPG channel name and the load time
+# of the EPG channels used to build it
+_channel_index = None
+_channel_index_loaded = 0
+# device name to (mapping, overrides) from the mapping file
+_mapping = None
+
 def get_device(channel):
     return _channel.get(channel)
 
@@ -84,6 +94,88 @@ def _rebuild_channels_dict():
                     _channel[channel] = device
 
 
+def _normalize_name(name):
+    return kaa.unicode_to_str(name.replace('.', '').replace(' ', '')).upper().strip()
+
+def _get_channel_index():
+    """
+    Return dict of normalized EPG channel names to EPG channel names
+    """
+    global _channel_index
+    global _channel_index_loaded
+    if _channel_index is None or _channel_index_loaded != timeline.channels_loaded():
+        # build again after the channels were reloaded
+        _channel_index = {}
+        _channel_index_loaded = timeline.channels_loaded()
+        for channel in timeline.get_channels():
+            _channel_index.setdefault(_normalize_name(channel.name), channel.name)
+    return _channel_index
+
+def _epg_updated():
+    """
+    Reset the channel index and map the device channels not found in
+    the EPG again, the update may have added them.
+    """
+    global _channel_index
+    _channel_index = None
+    remapped = False
+    for device in _devices:
+        if device.unmapped:
+            device.multiplexes = device.device_multiplexes
+            remapped = True
+    if remapped:
+        _rebuild_channels_dict()
+        signals['changed'].emit()
+
+epg.signals['updated'].connect(_epg_updated)
+
+def _mapping_filename():
+    return os.path.expandvars(os.path.expanduser(config.epg.mapping_file)).\
+           replace('$(HOME)', os.environ.get('HOME'))
+
+def _load_mapping():
+    """
+    Load the channel mapping file. Each device node contains channel
+    nodes with the guessed EPG name and override nodes with a manual
+    mapping, e.g. <override device="Das Erste HD">ARD</override>
+    """
+    global _mapping
+    _mapping = {}
+    filename = _mapping_filename()
+    if not os.path.isfile(filename):
+        return
+    try:
+        xml = kaa.xmlutils.create(filename, root='channels')
+    except Exception, e:
+        log.exception('unable to load %s', filename)
+        return
+    for node in xml:
+        if node.nodename != 'device':
+            continue
+        mapping, overrides = _mapping.setdefault(node.id, ({}, {}))
+        for child in node:
+            if child.nodename == 'channel':
+                mapping[child.device] = child.content
+            if child.nodename == 'override':
+                overrides[child.device] = child.content
+
+def _save_mapping():
+    """
+    Save the channel mapping file
+    """
+    xml = kaa.xmlutils.create(root='channels')
+    for name, (mapping, overrides) in sorted(_mapping.items()):
+        node = xml.add_child('device', id=name)
+        for channel, epg_channel in sorted(mapping.items()):
+            node.add_child('channel', epg_channel, device=channel)
+        for channel, epg_channel in sorted(overrides.items()):
+            node.add_child('override', epg_channel, device=channel)
+    filename = _mapping_filename()
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    xml.save(filename)
+
+
 class RecordingWrapper(object):
     """
     Wrapper for recordings to add some information from the device
@@ -115,28 +207,21 @@ class TVDevice(object):
         self.recordings = []
         self.capabilities = capabilities
 
-    def _normalize_name(self, name):
-        return kaa.unicode_to_str(name.replace('.', '').replace(' ', '')).upper().strip()
-
     def _get_epg_channel(self, name):
         """
         Try to guess EPG name based on given device channel name
         """
         # step 1, try tuner_id
-        channel = kaa.epg.guide.get_channel_by_tuner_id(name)
+        channel = timeline.get_channel_by_tuner_id(name)
         if channel:
             return channel.name
         # step 2, try name
-        channel = kaa.epg.guide.get_channel(name)
+        channel = timeline.get_channel(name)
         if channel:
             return channel.name
         # Now we start the ugly part of guessing
         # maybe the name is a little bit different
-        name = self._normalize_name(name)
-        for channel in kaa.epg.guide.get_channels():
-            if self._normalize_name(channel.name) == name:
-                return channel.name
-        return None
+        return _get_channel_index().get(_normalize_name(name))
 
     @property
     def multiplexes(self):
@@ -144,18 +229,35 @@ class TVDevice(object):
 
     @multiplexes.setter
     def multiplexes(self, multiplexes):
+        if _mapping is None:
+            _load_mapping()
+        # mapping from the last connect and manual overrides
+        mapping, overrides = _mapping.setdefault(self.name, ({}, {}))
+        modified = False
         self.__multiplexes = []
         self.channel_mapping = {}
+        # multiplexes with the device channel names and the channels
+        # not found in the EPG
+        self.device_multiplexes = multiplexes
+        self.unmapped = []
         for multiplex in multiplexes:
             epg_multiplex = []
             for ext_channel in multiplex:
-                epg_channel = self._get_epg_channel(ext_channel)
+                epg_channel = overrides.get(ext_channel) or mapping.get(ext_channel)
+                if not epg_channel:
+                    epg_channel = self._get_epg_channel(ext_channel)
+                    if epg_channel:
+                        mapping[ext_channel] = epg_channel
+                        modified = True
                 if not epg_channel:
                     log.error('unable to find %s', ext_channel)
+                    self.unmapped.append(ext_channel)
                     epg_channel = ext_channel
                 self.channel_mapping[ext_channel] = epg_channel
                 epg_multiplex.append(epg_channel)
             self.__multiplexes.append(epg_multiplex)
+        if modified:
+            _save_mapping()
 
     @property
     def current_multiplexes(self):
@@ -0,0 +1,163 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# dispatch.py - prioritized dispatch of incoming rpc calls
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# Calls from the devices controlling the recordings are handled when they
+# arrive. Client calls are put into one queue for each priority and are
+# handled one per main loop step, mutations before bulk reads. Between two
+# steps kaa reads the sockets again, so a device callback never waits for
+# more than one queued call. Bulk replies convert and encode the objects
+# in chunks of CHUNK objects per main loop step and compress them in
+# blocks of compress.BLOCK_SIZE bytes. Only pickling the reply before
+# the compression is done in one step.
+#
+# -----------------------------------------------------------------------------
+# TVServer - A generic TV device wrapper and scheduler
+# Copyright (C) 2009 Dirk Meyer, et al.
+#
+# First Edition: Dirk Meyer <dischi@freevo.org>
+# Maintainer:    Dirk Meyer <dischi@freevo.org>
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'priority', 'to_lists', 'encode', 'encode_recordings', 'wrap',
+            'CONTROL', 'MUTATION', 'BULK' ]
+
+# python imports
+import sys
+import functools
+from collections import deque
+
+# kaa imports
+import kaa
+
+# tvserver imports
+from .. import wire
+from .. import compress
+
+# priority classes
+CONTROL, MUTATION, BULK = range(3)
+
+# number of objects converted per main loop step
+CHUNK = 100
+
+# queued calls (InProgress, func, args, kwargs) for MUTATION and BULK
+_queues = { MUTATION: deque(), BULK: deque() }
+_running = False
+
+def priority(level):
+    """
+    Decorator to dispatch an exposed method with the given priority.
+    Calls with CONTROL priority are handled at once, all others return
+    an InProgress object finished with the result of the queued call.
+    """
+    def decorator(func):
+        if level == CONTROL:
+            return func
+        @functools.wraps(func)
+        def newfunc(*args, **kwargs):
+            async = kaa.InProgress()
+            _queues[level].append((async, func, args, kwargs))
+            if not _running:
+                _dispatch()
+            return async
+        return newfunc
+    return decorator
+
+
+@kaa.coroutine()
+def _dispatch():
+    """
+    Handle the queued calls, one per main loop step
+    """
+    global _running
+    _running = True
+    try:
+        while True:
+            # return to the main loop to read pending device calls
+            yield kaa.NotFinished
+            if _queues[MUTATION]:
+                async, func, args, kwargs = _queues[MUTATION].popleft()
+            elif _queues[BULK]:
+                async, func, args, kwargs = _queues[BULK].popleft()
+            else:
+                break
+            try:
+                result = func(*args, **kwargs)
+            except Exception, e:
+                async.throw(*sys.exc_info())
+                continue
+            if isinstance(result, kaa.InProgress):
+                result.connect_both(async.finish, async.throw)
+            else:
+                async.finish(result)
+    finally:
+        _running = False
+
+
+@kaa.coroutine()
+def to_lists(objects):
+    """
+    Return the to_list() results of all objects, CHUNK objects are
+    converted per main loop step.
+    """
+    result = []
+    for pos, obj in enumerate(objects[:]):
+        if pos and not pos % CHUNK:
+            yield kaa.NotFinished
+        result.append(obj.to_list())
+    yield result
+
+
+@kaa.coroutine()
+def _encode(encoder, rows):
+    """
+    Add the rows to the encoder, CHUNK rows per main loop step
+    """
+    for pos in range(0, len(rows), CHUNK):
+        if pos:
+            yield kaa.NotFinished
+        encoder.add(rows[pos:pos+CHUNK])
+    yield encoder.result()
+
+def encode(rows, interned=()):
+    """
+    Return an InProgress object for the result of wire.encode
+    """
+    return _encode(wire.Encoder(interned), rows)
+
+def encode_recordings(recordings, encoding):
+    """
+    Return an InProgress object for the result of wire.encode_recordings
+    """
+    return _encode(wire.RecordingEncoder(encoding), recordings)
+
+
+@kaa.coroutine()
+def wrap(value, method):
+    """
+    Return the result of compress.wrap, one block is compressed per
+    main loop step.
+    """
+    compressor = compress.Compressor(value, method)
+    while not compressor.step():
+        yield kaa.NotFinished
+    yield compressor.result
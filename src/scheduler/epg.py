@@ -33,6 +33,7 @@
 import os
 import sys
 import time
+import bisect
 import logging
 
 # kaa imports
@@ -41,20 +42,59 @@ import kaa.epg
 
 # record imports
 from recording import Recording, SCHEDULED, CONFLICT
+from matcher import FavoriteMatcher
+from ngram import TitleIndex
+import timeline
 from config import config
 
 # get logging object
 log = logging.getLogger('tvserver')
 
+# changed is emitted once after each check with the list of all
+# recordings added or moved, updated when the EPG is modified.
 signals = {
     'changed': kaa.Signal(),
+    'updated': kaa.Signal(),
 }
 
+# recordings added or moved in the current check
+_changes = []
+
+# compiled favorite matcher
+_matcher = None
+
+# EPG change watermark: the fingerprints of all future programs
+# already matched against the favorites, a flag if the EPG changed
+# since the last check and the time of the last full check.
+_fingerprints = {}
+_epg_changed = False
+_last_sweep = 0
+
+# favorites added or modified since the last check
+_new_favorites = []
+
+# kaa.epg database filename and its modification time when the EPG was
+# last marked as changed. Updates through the kaa.epg server, e.g. from
+# XMLTV grabbers, are only noticed by the modified database.
+_database = None
+_mtime = None
+
+# interval to check the database for modifications
+POLL_INTERVAL = 60
+
+# trigram index of all titles in the epg
+titles = TitleIndex()
+
 def init():
+    global _database
+    global _mtime
     # get kaa.epg database filename
     db = os.path.expandvars(os.path.expanduser(config.epg.database)).\
          replace('$(HOME)', os.environ.get('HOME'))
     kaa.epg.load(db)
+    _database = db
+    _mtime = _get_mtime()
+    kaa.Timer(poll).start(POLL_INTERVAL)
 
     # update config.epg.mapping information
 #     channels = [ c.name for c in kaa.epg.get_channels() ] + [ u'' ]
@@ -77,60 +117,89 @@ def check(recordings, favorites):
 
     @note: this function modifies the given recordings and favorites list
     """
+    poll()
     ctime = int(time.time()) + 60 * 15
-    to_check = [ r for r in recordings if r.start - r.start_padding > ctime and r.status in (CONFLICT, SCHEDULED) ]
+    # group the recordings to check by channel, each channel needs
+    # only one epg query covering all its recordings.
+    channels = {}
+    for r in recordings:
+        if r.start - r.start_padding > ctime and r.status in (CONFLICT, SCHEDULED):
+            channels.setdefault(r.channel, []).append(r)
     # check recordings
-    while to_check:
-        if len(to_check) % 10 == 0:
-            # back to mainloop
-            yield kaa.NotFinished
-        # get one recording to check
-        rec = to_check.pop(0)
-        check_recording(rec)
+    for channel, to_check in channels.items():
+        yield check_channel(channel, to_check)
+        # back to mainloop
+        yield kaa.NotFinished
     # check favorites
-    to_check = favorites[:]
-    while to_check:
-        if len(to_check) % 10 == 0:
-            # back to mainloop
-            yield kaa.NotFinished
-        # get favorite to check
-        fav = to_check.pop(0)
-        check_favorite(fav, recordings)
+    yield check_favorites(recordings, favorites)
+    _emit_changes()
+
+
+def _emit_changes():
+    """
+    Emit the changes collected during the check as one change set
+    """
+    global _changes
+    changes, _changes = _changes, []
+    if changes:
+        signals['changed'].emit(changes)
 
 
-def check_recording(rec):
+@kaa.coroutine()
+def check_channel(name, recordings):
     """
-    Search epg for that recording. The recording should be at the
-    same time, maybe it has moved +- 20 minutes. If the program
-    moved a larger time interval, it won't be found again.
+    Search epg for all given recordings on the channel. The recording
+    should be at the same time, maybe it has moved +- 20 minutes. If
+    the program moved a larger time interval, it won't be found again.
     """
-    interval = (rec.start - 20 * 60, rec.start + 20 * 60)
-    channel = kaa.epg.get_channel(rec.channel)
+    channel = timeline.get_channel(name)
     if not channel:
-        log.error('unable to find %s in epg database', rec.channel)
-        return
-    # Try to find the exact title again.
-    results = kaa.epg.search(title=rec.name, channel=channel, time=interval)
-    for epginfo in results:
-        # check all results
+        log.error('unable to find %s in epg database', name)
+        yield False
+    programs = timeline.get_programs()
+    if isinstance(programs, kaa.InProgress):
+        programs = yield programs
+    # get all programs in the time span covering all recordings
+    interval = (min([ r.start for r in recordings ]) - 20 * 60,
+                max([ r.start for r in recordings ]) + 20 * 60)
+    if interval[1] <= programs.stop:
+        titles = programs.get_channel(name).titles()
+    else:
+        # recordings behind the horizon of the cache
+        listing = kaa.epg.search(channel=channel, time=interval)
+        if isinstance(listing, kaa.InProgress):
+            listing = yield listing
+        titles = timeline.Channel(name, listing).titles()
+    for rec in recordings:
+        check_recording(rec, *titles.get(rec.name, ([], [])))
+    yield True
+
+
+def check_recording(rec, starts, listing):
+    """
+    Check the recording against the programs with the same title on
+    the recording's channel. The list of programs is sorted by start
+    time, starts contains the start times of these programs.
+    """
+    first = bisect.bisect_right(starts, rec.start - 20 * 60)
+    last = bisect.bisect_left(starts, rec.start + 20 * 60)
+    for epginfo in listing[first:last]:
         if epginfo.start_timestamp == rec.start and epginfo.stop_timestamp == rec.stop:
             # found the recording
             log.debug('found recording: %s', rec.name)
             break
     else:
-        # try to find it
-        for epginfo in results:
-            if rec.start - 20 * 60 < epginfo.start_timestamp < rec.start + 20 * 60:
-                # found it again, set new start and stop time
-                old_info = str(rec)
-                rec.start = epginfo.start_timestamp
-                rec.stop = epginfo.stop_timestamp
-                log.info('changed schedule\n%s\n%s' % (old_info, rec))
-                signals['changed'].emit(rec)
-                break
-        else:
+        if first == last:
             log.info('unable to find recording in epg:\n%s' % rec)
             return
+        # found it again, use the program nearest to the old start
+        # time and set new start and stop time
+        epginfo = min(listing[first:last], key=lambda p: abs(p.start_timestamp - rec.start))
+        old_info = str(rec)
+        rec.start = epginfo.start_timestamp
+        rec.stop = epginfo.stop_timestamp
+        log.info('changed schedule\n%s\n%s' % (old_info, rec))
+        _changes.append(rec)
     # check if attributes changed
     for attr in ('description', 'episode', 'subtitle'):
         newattr = getattr(epginfo, attr)
@@ -140,37 +209,176 @@ def check_recording(rec):
             setattr(rec, attr, getattr(epginfo, attr))
 
 
-def check_favorite(fav, recordings):
+def update_favorites(favorites, new=None):
+    """
+    Compile the list of favorites for matching. This function must be
+    called when the list of favorites or a favorite itself changes. The
+    new favorites, added or modified, are checked against all programs
+    in the next check. If new is None, all favorites are checked.
+    """
+    global _matcher
+    global _last_sweep
+    _matcher = FavoriteMatcher(favorites)
+    if new is None:
+        _last_sweep = 0
+    else:
+        _new_favorites.extend(new)
+
+
+def _get_mtime():
+    """
+    Return the modification time of the kaa.epg database or None
+    """
+    try:
+        return os.stat(_database).st_mtime
+    except (OSError, TypeError):
+        return None
+
+
+def poll():
+    """
+    Mark the EPG as changed if the kaa.epg database was modified
+    """
+    if _get_mtime() != _mtime:
+        log.info('kaa.epg database modified')
+        changed()
+    return True
+
+
+def changed():
+    """
+    Mark the EPG as changed. The next favorite check will match the
+    programs added or modified since the last check.
+    """
+    global _epg_changed
+    global _mtime
+    _epg_changed = True
+    _mtime = _get_mtime()
+    timeline.invalidate()
+    signals['updated'].emit()
+
+
+@kaa.coroutine()
+def check_favorites(recordings, favorites):
+    """
+    Check the favorites against the EPG cache and add recordings. All favorites
+    are matched together in one pass over the programs in the db. Only
+    programs added or modified since the last check are matched, except
+    when the sweep interval is over. New favorites are checked against
+    all programs using the title index.
+
+    @note: this function modifies the given recordings and favorites list
+    """
+    global _fingerprints
+    global _epg_changed
+    global _last_sweep
+    global _new_favorites
+    global titles
+    if not favorites:
+        yield False
+    if _matcher is None:
+        update_favorites(favorites)
+    now = int(time.time())
+    full = now - _last_sweep > int(config.epg.sweep_interval)
+    # new favorites still in the list
+    new = [ f for f in favorites if [ n for n in _new_favorites if n is f ] ]
+    _new_favorites = []
+    if new and not titles.ready:
+        # no index, check all programs
+        full = True
+    if not full and not _epg_changed and not new:
+        log.debug('epg unchanged, skip favorite check')
+        yield False
+    # recordings already known. This does not only avoid adding
+    # recordings twice, it also prevents from added a deleted
+    # favorite as active again.
+    known = set([ (r.name, r.channel, r.start, r.stop) for r in recordings ])
+    # one shot favorites already used in this run
+    done = []
+    if full or _epg_changed:
+        _epg_changed = False
+        programs = timeline.get_programs()
+        if isinstance(programs, kaa.InProgress):
+            programs = yield programs
+        listing = programs.get(now)
+        # compare the listing against the fingerprints from the last
+        # check and update the title index.
+        fingerprints = {}
+        to_match = []
+        if full:
+            # rebuild title index to remove old titles
+            titles = TitleIndex()
+        for p in listing:
+            key = p.channel.name, p.start_timestamp
+            fingerprints[key] = p.title, p.stop_timestamp
+            if full or _fingerprints.get(key) != fingerprints[key]:
+                to_match.append(p)
+                titles.add(p.title)
+        _fingerprints = fingerprints
+        if full:
+            _last_sweep = now
+            titles.ready = True
+        log.info('check %s of %s programs for favorites', len(to_match), len(listing))
+        yield _match_programs(to_match, _matcher, recordings, known, done)
+    if not full:
+        for fav in new:
+            if not fav in done:
+                yield check_favorite(fav, recordings, known, done)
+    if done:
+        for fav in done:
+            favorites.remove(fav)
+        update_favorites(favorites, [])
+    yield True
+
+
+@kaa.coroutine()
+def check_favorite(fav, recordings, known, done):
     """
-    Check the given favorite against the db and add recordings
+    Check one favorite against all programs in the EPG cache. The matching
+    titles are taken from the title index.
     """
-    # Note: we can't use keyword searching here because it won't match
-    # some favorite titles when they have short names.
     if fav.substring:
-        # unable to do that right now
-        listing = kaa.epg.search(keywords=fav.name)
+        names = titles.search(fav.name)
     else:
-        # 'like' search
-        listing = kaa.epg.search(title=kaa.epg.QExpr('like', fav.name))
-    now = time.time()
-    for p in listing:
-        if not fav.match(p.title, p.channel.name, p.start_timestamp):
-            continue
+        names = titles.get(fav.name)
+    if not names:
+        yield False
+    programs = timeline.get_programs()
+    if isinstance(programs, kaa.InProgress):
+        programs = yield programs
+    listing = programs.search(names, int(time.time()))
+    log.info('check %s programs for favorite %s', len(listing), fav.name)
+    yield _match_programs(listing, FavoriteMatcher([ fav ]), recordings, known, done)
+
+
+@kaa.coroutine()
+def _match_programs(listing, matcher, recordings, known, done):
+    """
+    Match the programs against the favorites of the matcher and add
+    recordings. Known contains the keys of all recordings, done the one
+    shot favorites already used.
+    """
+    now = int(time.time())
+    for pos, p in enumerate(sorted(listing, key=lambda p: p.start_timestamp)):
+        if pos and pos % 500 == 0:
+            # back to mainloop
+            yield kaa.NotFinished
         if p.stop_timestamp < now:
             # do not add old stuff
             continue
-        # we found a new recording.
-        rec = Recording(p.title, p.channel.name, fav.priority, p.start_timestamp, p.stop_timestamp,
-                  info={ "episode": p.episode, "subtitle": p.subtitle, "description": p.description } )
-        if rec in recordings:
-            # This does not only avoid adding recordings twice, it
-            # also prevents from added a deleted favorite as active
-            # again.
+        if (p.title, p.channel.name, p.start_timestamp, p.stop_timestamp) in known:
             continue
-        fav.update_recording(rec)
-        recordings.append(rec)
-        log.info('added\n%s', rec)
-        signals['changed'].emit(rec)
-        if fav.once:
-            favorites.remove(fav)
+        for fav in matcher.match(p.title, p.channel.name, p.start_timestamp):
+            if fav in done:
+                continue
+            # we found a new recording.
+            rec = Recording(p.title, p.channel.name, fav.priority, p.start_timestamp, p.stop_timestamp,
+                      info={ "episode": p.episode, "subtitle": p.subtitle, "description": p.description } )
+            fav.update_recording(rec)
+            recordings.append(rec)
+            known.add((rec.name, rec.channel, rec.start, rec.stop))
+            log.info('added\n%s', rec)
+            _changes.append(rec)
+            if fav.once:
+                done.append(fav)
             break
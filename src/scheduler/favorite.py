@@ -49,16 +49,20 @@ __all__ = [ 'Favorite' ]
 
 # python imports
 import re
-import time
 import logging
-from datetime import datetime
+
+# numpy is optional and only needed for match_start_times
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # kaa imports
 import kaa
-import kaa.dateutils
 
 # record imports
 from config import config
+from .. import localtime
 
 # get logging object
 log = logging.getLogger('tvserver')
@@ -66,6 +70,9 @@ log = logging.getLogger('tvserver')
 # internal regexp for time format
 _time_re = re.compile('([0-9]*):([0-9]*)-([0-9]*):([0-9]*)')
 
+# minutes in a week, the week starts Sunday 00:00 (strftime %w)
+WEEK_MINUTES = 7 * 24 * 60
+
 class Favorite(object):
     """
     Base class for a favorite.
@@ -89,6 +96,7 @@ class Favorite(object):
         self.stop_padding  = config.recording.stop_padding
         if node:
             self._add_xml_data(node)
+        self.compile()
 
     def _add_xml_data(self, node):
         """
@@ -122,35 +130,59 @@ class Favorite(object):
             if child.nodename == 'priority':
                 setattr(self, 'priority', int(child.content))
 
+    def compile(self):
+        """
+        Precompile the information needed for matching. This function must
+        be called again when the favorite is modified.
+        """
+        self._name = self.name.lower()
+        self._channels = set(self.channels)
+        # bit array with all matching minutes of the week
+        self._week = bytearray(WEEK_MINUTES / 8)
+        for t in self.times:
+            m = _time_re.match(t).groups()
+            start = int(m[0]) * 60 + int(m[1])
+            stop  = int(m[2]) * 60 + int(m[3])
+            for day in self.days:
+                for minute in range(day * 1440 + start, day * 1440 + stop + 1):
+                    self._week[minute >> 3] |= 1 << (minute & 7)
+
     def match(self, name, channel, start):
         """
         Return True if name, channel and start match this favorite.
         """
-        if kaa.str_to_unicode(name.lower()) != self.name.lower() and not self.substring:
-            return False
-        if name.lower().find(self.name.lower()) == -1:
+        if kaa.str_to_unicode(name.lower()) != self._name and not self.substring:
             return False
-        if not channel in self.channels:
+        if name.lower().find(self._name) == -1:
             return False
-        # convert start time into struct in localtime
-        timetuple = datetime.fromtimestamp(start, kaa.dateutils.local).timetuple()
-        if not int(time.strftime('%w', timetuple)) in self.days:
+        return self.match_channel_time(channel, start)
+
+    def match_channel_time(self, channel, start):
+        """
+        Return True if channel and start match this favorite.
+        """
+        if not channel in self._channels:
             return False
-        stime = int(timetuple[3]) * 100 + int(timetuple[4])
-        for t in self.times:
-            m = _time_re.match(t).groups()
-            start = int(m[0])*100 + int(m[1])
-            stop  = int(m[2])*100 + int(m[3])
-            if stime >= start and stime <= stop:
-                return True
-        return False
+        minute = localtime.minute_of_week(start)
+        return bool(self._week[minute >> 3] & (1 << (minute & 7)))
+
+    def match_start_times(self, starts):
+        """
+        Return a boolean numpy array which start times in the given numpy
+        array of timestamps match the days and times of this favorite.
+        """
+        if numpy is None:
+            raise ImportError('numpy not installed')
+        minutes = localtime.minutes_of_week(starts)
+        week = numpy.frombuffer(buffer(self._week), dtype=numpy.uint8)
+        return ((week[minutes >> 3] >> (minutes & 7)) & 1).astype(bool)
 
     def _fill_template(self, rec, text, is_url):
         """
         Fill template like url and fxdname from the favorite to something
         specific for the recording.
         """
-        t = time.strftime('%Y %m %d %H:%M', time.localtime(rec.start))
+        t = localtime.strftime('%Y %m %d %H:%M', rec.start)
         year, month, day, hour_min = t.split(' ')
         options = { 'title'    : rec.name,
                     'year'     : year,
@@ -176,6 +208,7 @@ class Favorite(object):
         Update recording based on data from the favorite
         """
         rec.favorite = True
+        rec.favorite_id = self.id
         rec.start_padding = self.start_padding
         rec.stop_padding  = self.stop_padding
         rec.fxdname = self.fxdname
@@ -0,0 +1,138 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# index.py - index of the recordings for list queries
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# The recordings are sorted by start time and id, the position in that
+# list is indexed by channel, status and favorite id. A query uses bisect
+# for the time window and the smallest index for the other filters. The
+# cursor of a page is the (start, id) key of the last recording
+# returned, it stays valid when the index is created again.
+#
+# -----------------------------------------------------------------------------
+# TVServer - A generic TV device wrapper and scheduler
+# Copyright (C) 2009 Dirk Meyer, et al.
+#
+# First Edition: Dirk Meyer <dischi@freevo.org>
+# Maintainer:    Dirk Meyer <dischi@freevo.org>
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'RecordingIndex' ]
+
+# python imports
+import bisect
+
+# kaa imports
+import kaa
+
+class RecordingIndex(object):
+    """
+    Index of the recordings
+    """
+    def __init__(self, recordings, version):
+        # changelog version of the recordings
+        self.version = version
+        self.recordings = sorted(recordings, key=lambda r: (r.start, r.id))
+        self.keys = [ (r.start, r.id) for r in self.recordings ]
+        self.maxlen = 0
+        self._index = { 'channel': {}, 'status': {}, 'favorite_id': {} }
+        for pos, r in enumerate(self.recordings):
+            self.maxlen = max(self.maxlen, r.stop - r.start)
+            for attr, index in self._index.items():
+                index.setdefault(getattr(r, attr), []).append(pos)
+
+    def _positions(self, start, stop, channels, statuses, favorite_id):
+        """
+        Return the sorted list of candidate positions
+        """
+        first, last = 0, len(self.recordings)
+        if start is not None:
+            first = bisect.bisect_left(self.keys, (start - self.maxlen,))
+        if stop is not None:
+            last = bisect.bisect_left(self.keys, (stop,))
+        candidates = []
+        for attr, values in (('channel', channels), ('status', statuses),
+                             ('favorite_id', favorite_id is not None and [ favorite_id ] or None)):
+            if values is not None:
+                positions = []
+                for value in values:
+                    positions.extend(self._index[attr].get(value, []))
+                candidates.append(positions)
+        if not candidates:
+            return range(first, last)
+        candidates.sort(key=len)
+        positions = set([ pos for pos in candidates[0] if first <= pos < last ])
+        for other in candidates[1:]:
+            positions.intersection_update(other)
+        return sorted(positions)
+
+    def _matches(self, start, stop, channels, statuses, favorite_id, text, cursor):
+        """
+        Iterate over the positions of the recordings matching all filters
+        """
+        if text:
+            text = kaa.str_to_unicode(text).lower()
+        cursor_pos = 0
+        if cursor is not None:
+            cursor_pos = bisect.bisect_right(self.keys, tuple(cursor))
+        for pos in self._positions(start, stop, channels, statuses, favorite_id):
+            if pos < cursor_pos:
+                continue
+            r = self.recordings[pos]
+            if start is not None and r.stop <= start:
+                continue
+            if favorite_id is not None and r.favorite_id != favorite_id:
+                continue
+            if text and not [ True for value in (r.name, r.subtitle, r.description) \
+                              if text in kaa.str_to_unicode(value).lower() ]:
+                continue
+            yield pos
+
+    def query(self, start=None, stop=None, channels=None, statuses=None, favorite_id=None,
+              text=None, cursor=None, limit=None):
+        """
+        Return the recordings matching all given filters sorted by start
+        time and the cursor for the next page or None if there are no
+        more recordings. Recordings running between start and stop match
+        the time window, text is searched in the name, subtitle and
+        description ignoring the case.
+        """
+        if limit is not None and limit < 1:
+            raise ValueError('limit must be at least 1, got %s' % limit)
+        result = []
+        last = None
+        for pos in self._matches(start, stop, channels, statuses, favorite_id, text, cursor):
+            if limit is not None and len(result) == limit:
+                # more recordings, return the cursor for the next page
+                return result, self.keys[last]
+            result.append(self.recordings[pos])
+            last = pos
+        return result, None
+
+    def count(self, start=None, stop=None, channels=None, statuses=None, favorite_id=None,
+              text=None):
+        """
+        Return the number of recordings matching the filters of query
+        """
+        count = 0
+        for pos in self._matches(start, stop, channels, statuses, favorite_id, text, None):
+            count += 1
+        return count
@@ -0,0 +1,230 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# ingest.py - chunked EPG upload from devices
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# A device sends its EPG with epg_begin, a number of epg_chunk calls with
+# increasing sequence numbers and epg_end. The chunks are written to a
+# spool file as they arrive, so the scheduler only holds one chunk in
+# memory. On epg_end the spool file is passed to kaa.epg.
+#
+# A chunk is either a part of a XMLTV file or, for the backend 'programs',
+# a list of program tuples (channel id, start, stop, title, subtitle,
+# episode, description) from the device XMLTV parser. These programs are
+# written as XMLTV file with the channels sent with epg_end.
+#
+# The chunks are not applied one by one: kaa.epg.update imports one
+# complete source file and has no interface to add programs to a running
+# update. A XMLTV chunk is not even a valid document on its own, and the
+# programs of a 'programs' chunk need the channels only known at
+# epg_end. The kaa.epg sources parse the file and write the database
+# in their own thread and return an InProgress object, so the single
+# update does not block the main loop. Creating the XMLTV file from the
+# spooled programs is done in a thread as well.
+#
+# All devices with the same channels send the same programs. A content
+# hash of each program, keyed by channel id and start time, is kept for
+# all uploads and programs already seen unchanged are dropped before
+# they reach kaa.epg.
+#
+# -----------------------------------------------------------------------------
+# TVServer - A generic TV device wrapper and scheduler
+# Copyright (C) 2009 Dirk Meyer, et al.
+#
+# First Edition: Dirk Meyer <dischi@freevo.org>
+# Maintainer:    Dirk Meyer <dischi@freevo.org>
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'EPGIngest' ]
+
+# python imports
+import os
+import time
+import shutil
+import tempfile
+import logging
+from xml.sax.saxutils import escape, quoteattr
+
+# kaa imports
+import kaa
+import kaa.epg
+
+# tvserver imports
+import epg
+
+# get logging object
+log = logging.getLogger('tvserver')
+
+# content hash of each program seen, the key is (channel id, start)
+_hashes = {}
+
+def _xmltv_time(t):
+    """
+    Convert seconds since Epoch to XMLTV time in UTC
+    """
+    return time.strftime('%Y%m%d%H%M%S +0000', time.gmtime(t))
+
+
+class EPGIngest(object):
+    """
+    EPG upload from one device
+    """
+    NEXT_ID = 0
+
+    def __init__(self, device, backend):
+        self.id = EPGIngest.NEXT_ID
+        EPGIngest.NEXT_ID += 1
+        self.device = device
+        self.backend = backend
+        # next expected sequence number
+        self.seq = 0
+        # old hashes of the programs written by this upload
+        self._replaced = {}
+        self.skipped = 0
+        fd, self.filename = tempfile.mkstemp(prefix='tvserver-epg-')
+        self._file = os.fdopen(fd, 'w')
+        log.info('start epg upload %s from %s', self.id, self.device)
+
+    def add(self, seq, data):
+        """
+        Add the chunk with the given sequence number
+        """
+        if seq != self.seq:
+            raise ValueError('epg upload %s: expected chunk %s, got %s' % (self.id, self.seq, seq))
+        if self.backend == 'programs':
+            self.add_programs(data)
+        else:
+            self._file.write(kaa.unicode_to_str(data))
+        self.seq += 1
+
+    def add_programs(self, programs):
+        """
+        Write the program tuples as XMLTV programme elements
+        """
+        for program in programs:
+            key = program[0], program[1]
+            content = hash(tuple(program))
+            if _hashes.get(key) == content:
+                # duplicate or unchanged program
+                self.skipped += 1
+                continue
+            if not key in self._replaced:
+                self._replaced[key] = _hashes.get(key)
+            _hashes[key] = content
+            channel, start, stop, title, subtitle, episode, description = program
+            epg.titles.add(title)
+            attrs = 'channel=%s start="%s"' % (quoteattr(channel), _xmltv_time(start))
+            if stop:
+                attrs += ' stop="%s"' % _xmltv_time(stop)
+            data = u'<programme %s><title>%s</title>' % (attrs, escape(title))
+            if subtitle:
+                data += u'<sub-title>%s</sub-title>' % escape(subtitle)
+            if episode:
+                data += u'<episode-num>%s</episode-num>' % escape(episode)
+            if description:
+                data += u'<desc>%s</desc>' % escape(description)
+            self._file.write((data + u'</programme>\n').encode('utf-8'))
+
+    @kaa.threaded()
+    def _write_xmltv(self, channels):
+        """
+        Create the XMLTV file with the channels and the spooled programs.
+        This function is called in a thread to not block the main loop
+        while copying the spool file.
+        """
+        fd, filename = tempfile.mkstemp(prefix='tvserver-epg-')
+        xmltv = os.fdopen(fd, 'w')
+        xmltv.write('<?xml version="1.0" encoding="utf-8"?>\n<tv>\n')
+        for id, name in channels.items():
+            xmltv.write((u'<channel id=%s><display-name>%s</display-name></channel>\n' % \
+                         (quoteattr(id), escape(name))).encode('utf-8'))
+        programs = open(self.filename)
+        shutil.copyfileobj(programs, xmltv)
+        programs.close()
+        xmltv.write('</tv>\n')
+        xmltv.close()
+        os.unlink(self.filename)
+        self.filename = filename
+
+    @kaa.coroutine()
+    def finish(self, count, channels=None):
+        """
+        Finish the upload after count chunks and update kaa.epg. The
+        channels are a dict of channel id to name for the backend
+        'programs'.
+        """
+        self._file.close()
+        if count != self.seq:
+            self.abort()
+            raise ValueError('epg upload %s: expected %s chunks, got %s' % (self.id, count, self.seq))
+        log.info('finished epg upload %s from %s (%s chunks, %s programs unchanged)',
+                 self.id, self.device, count, self.skipped)
+        if self.backend == 'programs' and not self._replaced:
+            log.info('no new programs in epg upload %s', self.id)
+            os.unlink(self.filename)
+            yield False
+        try:
+            backend = self.backend
+            if backend == 'programs':
+                yield self._write_xmltv(channels or {})
+                backend = 'xmltv'
+            result = kaa.epg.update(backend, self.filename)
+            if isinstance(result, kaa.InProgress):
+                yield result
+        except Exception, e:
+            self._rollback()
+            raise
+        finally:
+            os.unlink(self.filename)
+        self._prune()
+        # mark epg as changed for the next favorite check
+        epg.changed()
+        yield True
+
+    def _rollback(self):
+        """
+        Restore the program hashes after a failed upload
+        """
+        for key, content in self._replaced.items():
+            if content is None:
+                _hashes.pop(key, None)
+            else:
+                _hashes[key] = content
+        self._replaced = {}
+
+    def _prune(self):
+        """
+        Remove the hashes of programs started more than one day ago
+        """
+        ctime = int(time.time()) - 24 * 60 * 60
+        for key in _hashes.keys():
+            if key[1] < ctime:
+                del _hashes[key]
+
+    def abort(self):
+        """
+        Abort the upload
+        """
+        log.info('abort epg upload %s from %s', self.id, self.device)
+        self._rollback()
+        if not self._file.closed:
+            self._file.close()
+        os.unlink(self.filename)
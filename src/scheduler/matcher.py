@@ -0,0 +1,130 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# matcher.py - match all favorites against the EPG in one pass
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# The FavoriteMatcher is compiled once when the list of favorites changes.
+# Exact favorites are looked up in a dict by lower case title, substring
+# favorites are found with an Aho-Corasick automaton over the lower case
+# title. The channel, day and time checks are precompiled in the Favorite
+# objects itself.
+#
+# -----------------------------------------------------------------------------
+# TVServer - A generic TV device wrapper and scheduler
+# Copyright (C) 2009 Dirk Meyer, et al.
+#
+# First Edition: Dirk Meyer <dischi@freevo.org>
+# Maintainer:    Dirk Meyer <dischi@freevo.org>
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'FavoriteMatcher' ]
+
+# kaa imports
+import kaa
+
+
+class Automaton(object):
+    """
+    Aho-Corasick automaton to find all given patterns in a text with
+    one scan over the text.
+    """
+    def __init__(self, patterns):
+        """
+        Build the automaton. The patterns are a list of (string, value)
+        tuples, search returns the values of all patterns found.
+        """
+        # goto function, failure function and output per state
+        self._goto = [ {} ]
+        self._fail = [ 0 ]
+        self._out = [ [] ]
+        for pattern, value in patterns:
+            state = 0
+            for char in pattern:
+                if not char in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._out[state].append(value)
+        # breadth-first run to set the failure function
+        queue = self._goto[0].values()
+        while queue:
+            state = queue.pop(0)
+            for char, next in self._goto[state].items():
+                queue.append(next)
+                fail = self._fail[state]
+                while fail and not char in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next] = self._goto[fail].get(char, 0)
+                if self._fail[next] == next:
+                    self._fail[next] = 0
+                self._out[next] = self._out[next] + self._out[self._fail[next]]
+
+    def search(self, text):
+        """
+        Return the values of all patterns found in the text
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        result = []
+        state = 0
+        for char in text:
+            while state and not char in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                result.extend(out[state])
+        return result
+
+
+class FavoriteMatcher(object):
+    """
+    Compiled matcher for a list of favorites.
+    """
+    def __init__(self, favorites):
+        self.favorites = favorites[:]
+        self._exact = {}
+        substring = []
+        for pos, fav in enumerate(self.favorites):
+            if fav.substring:
+                substring.append((fav.name.lower(), pos))
+            else:
+                self._exact.setdefault(fav.name.lower(), []).append(pos)
+        self._automaton = None
+        if substring:
+            self._automaton = Automaton(substring)
+
+    def match(self, title, channel, start):
+        """
+        Return the list of favorites matching the given title, channel
+        and start time. The favorites are in the order of the favorites
+        list used to create the matcher.
+        """
+        title = kaa.str_to_unicode(title).lower()
+        candidates = self._exact.get(title, [])
+        if self._automaton:
+            candidates = candidates + self._automaton.search(title)
+        result = []
+        for pos in sorted(set(candidates)):
+            fav = self.favorites[pos]
+            if fav.match_channel_time(channel, start):
+                result.append(fav)
+        return result
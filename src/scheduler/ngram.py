@@ -0,0 +1,102 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# ngram.py - trigram index over the EPG titles
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# Each title is split into all trigrams of its lower case version. A
+# substring search intersects the sets of titles for all trigrams of the
+# search text, starting with the smallest set, and checks the remaining
+# titles. Search texts shorter than three characters check all titles.
+#
+# -----------------------------------------------------------------------------
+# TVServer - A generic TV device wrapper and scheduler
+# Copyright (C) 2009 Dirk Meyer, et al.
+#
+# First Edition: Dirk Meyer <dischi@freevo.org>
+# Maintainer:    Dirk Meyer <dischi@freevo.org>
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'TitleIndex' ]
+
+# kaa imports
+import kaa
+
+class TitleIndex(object):
+    """
+    Trigram index over titles
+    """
+    def __init__(self):
+        # the index is ready after it was filled with all titles once
+        self.ready = False
+        # title id to title and lower case title
+        self._titles = []
+        self._lower = []
+        # title to title id
+        self._ids = {}
+        # lower case title to titles
+        self._exact = {}
+        # trigram to set of title ids
+        self._grams = {}
+
+    def add(self, title):
+        """
+        Add a title to the index
+        """
+        if title in self._ids:
+            return
+        lower = kaa.str_to_unicode(title).lower()
+        id = len(self._titles)
+        self._titles.append(title)
+        self._lower.append(lower)
+        self._ids[title] = id
+        self._exact.setdefault(lower, []).append(title)
+        for pos in range(len(lower) - 2):
+            self._grams.setdefault(lower[pos:pos+3], set()).add(id)
+
+    def get(self, title):
+        """
+        Return all titles equal to the given title ignoring the case
+        """
+        return self._exact.get(kaa.str_to_unicode(title).lower(), [])[:]
+
+    def search(self, text):
+        """
+        Return all titles containing the text ignoring the case
+        """
+        text = kaa.str_to_unicode(text).lower()
+        if len(text) < 3:
+            return [ self._titles[id] for id, lower in enumerate(self._lower) if text in lower ]
+        postings = []
+        for pos in range(len(text) - 2):
+            ids = self._grams.get(text[pos:pos+3])
+            if not ids:
+                return []
+            postings.append(ids)
+        postings.sort(key=len)
+        ids = postings[0]
+        for p in postings[1:]:
+            ids = ids.intersection(p)
+            if not ids:
+                return []
+        return [ self._titles[id] for id in sorted(ids) if text in self._lower[id] ]
+
+    def __len__(self):
+        return len(self._titles)
@@ -39,16 +39,15 @@ import re
 import string
 import logging
 import os
-from datetime import datetime
 
 # kaa imports
 import kaa
-import kaa.dateutils
 from kaa.utils import property
 import kaa.xmlutils
 
 # record imports
 from config import config
+from .. import localtime
 
 # get logging object
 log = logging.getLogger('tvserver')
@@ -68,7 +67,7 @@ def _time_int2str(i):
     as int (UTC). The timestring contains the timezone as integer,
     e.g. CEST == +0200.
     """
-    return datetime.fromtimestamp(i, kaa.dateutils.local).strftime('%Y%m%d%H%M %z')
+    return localtime.strftime('%Y%m%d%H%M %z', i)
 #     adjust = time.timezone
 #     # FIXME: maybe cache this value, maybe use i and not time.time()
 #     # time.daylight does not do what we want
@@ -117,6 +116,8 @@ class Recording(object):
         self.stop_padding  = config.recording.stop_padding
         self.respect_start_padding = True
         self.respect_stop_padding = True
+        # id of the favorite which added the recording
+        self.favorite_id = None
         for key, value in info.items():
             if key in ('subtitle', 'description') and value:
                 setattr(self, key, kaa.str_to_unicode(value))
@@ -153,6 +154,8 @@ class Recording(object):
             if child.nodename == 'timer':
                 self.start = _time_str2int(child.start)
                 self.stop  = _time_str2int(child.stop)
+            if child.nodename == 'favorite':
+                self.favorite_id = int(child.id)
             if child.nodename == 'info':
                 for info in child:
                     self.info[info.nodename] = info.content
@@ -169,7 +172,7 @@ class Recording(object):
                            'title'   : kaa.unicode_to_str(self.subtitle) }
         filemask = config.recording.filemask % filename_array
         filename = ''
-        for letter in datetime.fromtimestamp(self.start, kaa.dateutils.local).strftime(filemask):
+        for letter in localtime.strftime(filemask, self.start):
             if letter in string.ascii_letters + string.digits:
                 filename += letter
             elif filename and filename[-1] != '_':
@@ -240,7 +243,7 @@ class Recording(object):
         info.add_child('runtime', '%s min.' % int((self.stop - self.start) / 60))
         info.add_child('record-start', int(time.time()))
         info.add_child('record-stop', self.stop + self.stop_padding)
-        info.add_child('year', datetime.fromtimestamp(self.start, kaa.dateutils.local).strftime('%m-%d %H:%M'))
+        info.add_child('year', localtime.strftime('%m-%d %H:%M', self.start))
         self._scheduled_device.create_fxd(self.url + '.fxd', fxd.toxml())
 
     def __str__(self):
@@ -267,10 +270,10 @@ class Recording(object):
             stop_padding = int(self.stop_padding/60)
         else:
             stop_padding = 0
+        start = _time_int2str(self.start)
         return '%3d %10s %-19s %4d %s/%s-%s %2s %2s %s' % \
                (self.id, kaa.unicode_to_str(channel), kaa.unicode_to_str(name),
-                self.priority, _time_int2str(self.start)[4:8],
-                _time_int2str(self.start)[8:-6], _time_int2str(self.stop)[8:],
+                self.priority, start[4:8], start[8:-6], _time_int2str(self.stop)[8:],
                 start_padding, stop_padding, kaa.unicode_to_str(status))
 
     def to_list(self):
@@ -303,6 +306,8 @@ class Recording(object):
             node.add_child('url', kaa.str_to_unicode(self.__url))
         node.add_child('timer', start=_time_int2str(self.start), stop=_time_int2str(self.stop))
         node.add_child('padding', start=self.start_padding, stop=self.stop_padding)
+        if self.favorite_id is not None:
+            node.add_child('favorite', id=self.favorite_id)
         info = node.add_child('info')
         for key, value in self.info.items():
             info.add_child(key, value)
@@ -41,6 +41,16 @@ import kaa.epg
 # tvserver imports
 from config import config
 from controller import Controller
+from ingest import EPGIngest
+from changelog import ChangeLog
+from client import Client
+from broadcast import Broadcast
+from index import RecordingIndex
+import dispatch
+from .. import wire
+from .. import compress
+from .. import metrics
+import epg
 from device import TVDevice, add_device, remove_device, get_devices
 
 # get logging object
@@ -49,8 +59,10 @@ log = logging.getLogger('tvserver')
 class RPCServer(Controller):
 
     def __init__(self, datafile):
-        self._last_listing = []
+        self._changelog = ChangeLog()
         self._clients = []
+        self._broadcast = Broadcast(self._clients)
+        self._index = None
         super(RPCServer, self).__init__(datafile)
 
     def listen(self):
@@ -63,6 +75,7 @@ class RPCServer(Controller):
         # get kaa.epg address and port
         ip, port = config.rpc.address.split(':')
         kaa.epg.listen('%s:%s' % (ip, int(port) + 1), config.rpc.password)
+        metrics.start_logging()
 
     @kaa.coroutine()
     def client_connected(self, client):
@@ -72,25 +85,49 @@ class RPCServer(Controller):
         client.signals['closed'].connect(self.client_closed, client)
         info = (yield client.rpc('identify'))
         if info == 'client':
-            self._clients.append(client)
+            self._client(client)
         else:
-            add_device(RPCDevice(client, *info))
+            device = RPCDevice(client, *info)
+            add_device(device)
+            device.negotiate()
 
     def client_closed(self, client):
         """
         Callback when a client disconnects.
         """
         log.info('Client disconnected: %s', client)
-        if client in self._clients:
-            self._clients.remove(client)
+        if self._get_client(client):
+            self._clients.remove(self._get_client(client))
+            metrics.forget(str(client))
         else:
             for device in get_devices():
                 if device.client == client:
+                    device.epg_abort()
                     remove_device(device)
                     break
             else:
                 log.error('unable to find device %s' % client)
 
+    def _get_client(self, channel):
+        """
+        Return the Client object for the rpc channel
+        """
+        for c in self._clients:
+            if c.channel == channel:
+                return c
+        return None
+
+    def _client(self, channel):
+        """
+        Return the Client object for the rpc channel. It is created if
+        the client calls the server before identify returned.
+        """
+        client = self._get_client(channel)
+        if client is None:
+            client = Client(channel)
+            self._clients.append(client)
+        return client
+
     @kaa.coroutine()
     def reschedule(self):
         """
@@ -98,42 +135,295 @@ class RPCServer(Controller):
         """
         if not (yield super(RPCServer, self).reschedule()):
             yield False
-        sending = []
-        listing = []
-        for r in self.recordings:
-            to_list = r.to_list()
-            listing.append(to_list)
-            if not to_list in self._last_listing:
-                sending.append(to_list)
-        self._last_listing = listing
-        # send update to all clients
-        if sending:
-            log.info("send update for %s recordings", len(sending))
-            for c in self._clients:
-                c.rpc('recording_update', *sending)
+        self._send_changes()
         yield True
 
+    def _align_favorites(self, ids=None):
+        super(RPCServer, self)._align_favorites(ids)
+        # favorite ids of the recordings may have changed
+        self._index = None
+
+    def _send_changes(self):
+        """
+        Send the changed recordings to all clients
+        """
+        changes = self._changelog.update(self.recordings)
+        if not changes:
+            return
+        self._broadcast.recordings(*changes)
+
     def _recorder_start(self, recording):
         super(RPCServer, self)._recorder_start(recording)
         # send update to all clients
-        for c in self._clients:
-            c.rpc('recording_update', recording.to_list())
+        self._send_changes()
 
     def _recorder_stop(self, recording):
         super(RPCServer, self)._recorder_stop(recording)
         # send update to all clients
-        for c in self._clients:
-            c.rpc('recording_update', recording.to_list())
+        self._send_changes()
 
-    @kaa.rpc.expose()
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure_client
+    @dispatch.priority(dispatch.BULK)
+    @kaa.coroutine()
     def recording_list(self):
         """
         list the current recordins in a short form.
         """
         log.info('send list for %s recordings' % len(self.recordings))
-        return [ r.to_list() for r in self.recordings ]
+        recordings = yield dispatch.to_lists(self.recordings)
+        yield recordings
+
+    def _get_index(self):
+        """
+        Return the index of the recordings, it is created again after
+        the recordings changed. Each change of the recordings is followed
+        by _send_changes which updates the changelog version.
+        """
+        if self._index is None or self._index.version != self._changelog.version:
+            self._index = RecordingIndex(self.recordings, self._changelog.version)
+        return self._index
+
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure
+    @dispatch.priority(dispatch.BULK)
+    def recording_query(self, client, cursor=None, limit=100, **filters):
+        """
+        Return one page of the recordings matching the filters sorted by
+        start time and the cursor for the next page or None. The filters
+        are start, stop, channels, statuses, favorite_id and text.
+        """
+        recordings, cursor = self._get_index().query(cursor=cursor, limit=limit, **filters)
+        client = self._client(client)
+        recordings = wire.encode_recordings([ r.to_list() for r in recordings ], client.encoding)
+        return compress.wrap((recordings, cursor), client.compression)
+
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure_client
+    @dispatch.priority(dispatch.BULK)
+    def recording_count(self, **filters):
+        """
+        Return the number of recordings matching the filters
+        """
+        return self._get_index().count(**filters)
+
+    def _favorite_query(self, text=None, channel=None):
+        """
+        Return the favorites matching the text and channel
+        """
+        if text:
+            text = kaa.str_to_unicode(text).lower()
+        result = []
+        for f in self.favorites:
+            if text and not text in kaa.str_to_unicode(f.name).lower():
+                continue
+            if channel and not channel in f.channels:
+                continue
+            result.append(f)
+        return result
+
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure_client
+    @dispatch.priority(dispatch.BULK)
+    def favorite_query(self, cursor=None, limit=100, text=None, channel=None):
+        """
+        Return one page of the favorites matching the text and channel
+        and the cursor for the next page or None. The favorites are
+        sorted by id, the cursor is the id of the last favorite.
+        """
+        if limit is not None and limit < 1:
+            raise ValueError('limit must be at least 1, got %s' % limit)
+        favorites = [ f for f in self._favorite_query(text, channel)
+                      if cursor is None or f.id > cursor ]
+        cursor = None
+        if limit is not None and len(favorites) > limit:
+            favorites = favorites[:limit]
+            cursor = favorites[-1].id
+        return [ f.to_list() for f in favorites ], cursor
+
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure_client
+    @dispatch.priority(dispatch.BULK)
+    def favorite_count(self, text=None, channel=None):
+        """
+        Return the number of favorites matching the text and channel
+        """
+        return len(self._favorite_query(text, channel))
+
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure
+    @dispatch.priority(dispatch.MUTATION)
+    def capabilities(self, client, capabilities):
+        """
+        Negotiate the capabilities of the client connection. The client
+        sends a dict with the encodings and compression methods it
+        supports, the server returns the dict with the ones used.
+        """
+        client = self._client(client)
+        client.legacy = False
+        for encoding in wire.ENCODINGS:
+            if encoding in capabilities.get('encodings', []):
+                client.encoding = encoding
+                break
+        client.compression = compress.negotiate(capabilities.get('compression'))
+        log.info('use %s encoding and %s compression for %s', client.encoding,
+                 client.compression, client.channel)
+        return { 'encoding': client.encoding, 'compression': client.compression }
+
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure
+    @dispatch.priority(dispatch.BULK)
+    @kaa.coroutine()
+    def recording_sync(self, client, epoch=None, version=None):
+        """
+        Return the recordings changed since the given version of the
+        client as (epoch, version, full, upserts, deletes). If the version
+        is not known anymore, full is True and upserts contains all
+        recordings. Only the recordings subscribed by the client are
+        returned, encoded with the encoding of the client.
+        """
+        yield (yield self._sync_reply(client, epoch, version, self._recording_sync))
+
+    @kaa.coroutine()
+    def _recording_sync(self, client, epoch, version, full, upserts, deletes):
+        """
+        Return the reply of recording_sync for the result of _sync
+        """
+        upserts = yield dispatch.encode_recordings(upserts, client.encoding)
+        yield (yield dispatch.wrap((epoch, version, full, upserts, deletes), client.compression))
+
+    @kaa.coroutine()
+    def _sync_reply(self, client, epoch, version, build):
+        """
+        Sync the client and return the reply created by the build
+        coroutine from the client and the result of _sync. Updates are
+        not sent to the client while the reply is built; if the
+        recordings changed in the meantime, the sync starts again.
+        """
+        client = self._client(client)
+        client.syncing = True
+        try:
+            while True:
+                result = yield self._sync(client, epoch, version)
+                reply = yield build(client, *result)
+                self._send_changes()
+                if result[1] == self._changelog.version:
+                    break
+        finally:
+            client.syncing = False
+        yield reply
+
+    @kaa.coroutine()
+    def _sync(self, client, epoch, version):
+        """
+        Return the result of recording_sync without encoding
+        """
+        client = self._client(client)
+        while True:
+            # send pending changes first, the version must match the list
+            self._send_changes()
+            self._broadcast.flush()
+            changes = None
+            if epoch is not None and not client.filtered:
+                changes = self._changelog.since(epoch, version)
+            if changes is not None:
+                break
+            # the recordings are converted in chunks, start again if they
+            # changed in the meantime
+            current = self._changelog.version
+            recordings = yield dispatch.to_lists(self.recordings)
+            self._send_changes()
+            if current == self._changelog.version:
+                break
+        epoch, version = self._changelog.epoch, self._changelog.version
+        if changes is None:
+            upserts, deletes = client.synced(version, True, recordings, [])
+            log.info('send version %s for %s recordings', version, len(upserts))
+            yield epoch, version, True, upserts, deletes
+        upserts, deletes = client.synced(version, False, *changes)
+        log.info('send changes up to version %s for %s recordings, %s removed',
+                 version, len(upserts), len(deletes))
+        yield epoch, version, False, upserts, deletes
+
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure
+    @dispatch.priority(dispatch.BULK)
+    @kaa.coroutine()
+    def snapshot(self, client, epoch=None, version=None):
+        """
+        Return the recordings changed since the given version like
+        recording_sync, the favorites and a summary of the devices in
+        one reply. Recordings and favorites are encoded with wire.
+        """
+        yield (yield self._sync_reply(client, epoch, version, self._snapshot))
+
+    @kaa.coroutine()
+    def _snapshot(self, client, epoch, version, full, upserts, deletes):
+        """
+        Return the reply of snapshot for the result of _sync
+        """
+        if client.encoding == 'compact':
+            encoding = 'compact'
+            recordings = yield dispatch.encode_recordings(upserts, 'compact')
+        else:
+            encoding = 'columns'
+            recordings = yield dispatch.encode(upserts, wire.RECORDING_INTERNED)
+        favorites = []
+        if client.favorites:
+            favorites = [ f.to_list() for f in self.favorites ]
+        devices = [ (d.name, d.rating, sum([ len(m) for m in d.multiplexes ]), len(d.recordings))
+                    for d in get_devices() ]
+        yield (yield dispatch.wrap({
+            'epoch': epoch,
+            'version': version,
+            'full': full,
+            'encoding': encoding,
+            'recordings': recordings,
+            'deletes': deletes,
+            'favorites': wire.encode(favorites),
+            'devices': devices
+        }, client.compression))
+
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure_client
+    @dispatch.priority(dispatch.BULK)
+    def client_stats(self):
+        """
+        Return the send queue metrics of all clients as list of
+        (client, stats) tuples.
+        """
+        return [ (str(c.channel), c.stats()) for c in self._clients ]
+
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure_client
+    @dispatch.priority(dispatch.BULK)
+    def compression_stats(self):
+        """
+        Return the bytes saved by compression and the CPU time used
+        """
+        return compress.stats
 
     @kaa.rpc.expose()
+    def stats(self):
+        """
+        Return the call metrics of the exposed methods as list of
+        (method, peer, calls, errors, bytes, items, time, histogram)
+        """
+        return metrics.get_stats()
+
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure
+    @dispatch.priority(dispatch.MUTATION)
+    def subscribe(self, client, start=None, stop=None, channels=None, statuses=None, favorites=True):
+        """
+        Set the subscription of the client. The client must sync all
+        recordings after changing the subscription.
+        """
+        self._client(client).subscribe(start, stop, channels, statuses, favorites)
+
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure_client
+    @dispatch.priority(dispatch.MUTATION)
     def recording_add(self, name, channel, priority, start, stop, **info):
         """
         add a new recording
@@ -141,28 +431,36 @@ class RPCServer(Controller):
         return super(RPCServer, self).recording_add(
             name, channel, priority, start, stop, **info).id
 
-    @kaa.rpc.expose()
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure_client
+    @dispatch.priority(dispatch.MUTATION)
     def recording_remove(self, id):
         """
         remove a recording
         """
         return super(RPCServer, self).recording_remove(id)
 
-    @kaa.rpc.expose()
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure_client
+    @dispatch.priority(dispatch.MUTATION)
     def rpc_recording_modify(self, id, **kwargs):
         """
         modify a recording
         """
         return super(RPCServer, self).rpc_recording_modify(id, **kwargs)
 
-    @kaa.rpc.expose()
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure_client
+    @dispatch.priority(dispatch.MUTATION)
     def favorite_update(self):
         """
         updates favorites with data from the database
         """
         return super(RPCServer, self).favorite_update()
 
-    @kaa.rpc.expose()
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure_client
+    @dispatch.priority(dispatch.BULK)
     def favorite_list(self):
         """
         Return list of all favorites
@@ -170,7 +468,9 @@ class RPCServer(Controller):
         log.info('send list for %s favorites' % len(self.favorites))
         return [ f.to_list() for f in self.favorites ]
 
-    @kaa.rpc.expose()
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure_client
+    @dispatch.priority(dispatch.MUTATION)
     def favorite_add(self, name, channels, priority, days, times, once, substring):
         """
         add a favorite
@@ -178,31 +478,38 @@ class RPCServer(Controller):
         super(RPCServer, self).favorite_add(
             name, channels, priority, days, times, once, substring)
         # send update to all clients
-        msg = [ f.to_list() for f in self.favorites ]
-        for c in self._clients:
-            c.rpc('favorite_update', *msg)
+        self._broadcast.favorites([ f.to_list() for f in self.favorites ])
 
-    @kaa.rpc.expose()
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure_client
+    @dispatch.priority(dispatch.MUTATION)
     def favorite_remove(self, id):
         """
         remove a favorite
         """
         super(RPCServer, self).favorite_remove(id)
         # send update to all clients
-        msg = [ f.to_list() for f in self.favorites ]
-        for c in self._clients:
-            c.rpc('favorite_update', *msg)
+        self._broadcast.favorites([ f.to_list() for f in self.favorites ])
 
-    @kaa.rpc.expose()
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure_client
+    @dispatch.priority(dispatch.MUTATION)
     def favorite_modify(self, id, **kwargs):
         """
         modify a recording
         """
         super(RPCServer, self).favorite_modify(id, **kwargs)
         # send update to all clients
-        msg = [ f.to_list() for f in self.favorites ]
-        for c in self._clients:
-            c.rpc('favorite_update', *msg)
+        self._broadcast.favorites([ f.to_list() for f in self.favorites ])
+
+    @kaa.rpc.expose(add_client=True)
+    @metrics.measure_client
+    @dispatch.priority(dispatch.BULK)
+    def epg_title_search(self, text):
+        """
+        Return all EPG titles containing the text
+        """
+        return epg.titles.search(text)
 
 
 class RPCDevice(TVDevice):
@@ -211,6 +518,24 @@ class RPCDevice(TVDevice):
         super(RPCDevice, self).__init__(name, priority, multiplexes, capabilities)
         rpcsocket.register(self)
         self.client = rpcsocket
+        # current chunked epg upload
+        self._ingest = None
+        # compression used by the device
+        self.compression = None
+
+    @kaa.coroutine()
+    def negotiate(self):
+        """
+        Negotiate the capabilities of the device connection
+        """
+        try:
+            capabilities = yield self.client.rpc('capabilities', { 'compression': compress.METHODS })
+        except Exception, e:
+            log.info('device %s does not support capabilities', self.name)
+            yield False
+        self.compression = capabilities.get('compression')
+        log.info('use %s compression for %s', self.compression, self.name)
+        yield True
 
     def schedule(self, recording, start, stop):
         super(RPCDevice, self).schedule(recording, start, stop)
@@ -248,17 +573,68 @@ class RPCDevice(TVDevice):
         return self.client.rpc('create_fxd', filename, content)
 
     @kaa.rpc.expose()
+    @metrics.measure
     def started(self, id):
         for remote in self.recordings[:]:
             if remote.id == id:
                 remote.started()
 
     @kaa.rpc.expose()
+    @metrics.measure
     def stopped(self, id):
         for remote in self.recordings[:]:
             if remote.id == id:
                 remote.stopped()
 
+    def epg_abort(self):
+        """
+        Abort the current epg upload
+        """
+        if self._ingest:
+            self._ingest.abort()
+            self._ingest = None
+
     @kaa.rpc.expose()
+    @metrics.measure
+    def epg_begin(self, backend):
+        """
+        Start a chunked epg upload and return the upload id
+        """
+        self.epg_abort()
+        self._ingest = EPGIngest(self, backend)
+        return self._ingest.id
+
+    @kaa.rpc.expose()
+    @metrics.measure
+    def epg_chunk(self, id, seq, data):
+        """
+        Add chunk number seq to the epg upload
+        """
+        if not self._ingest or self._ingest.id != id:
+            raise ValueError('unknown epg upload %s' % id)
+        try:
+            self._ingest.add(seq, compress.unwrap(data))
+        except ValueError:
+            self.epg_abort()
+            raise
+
+    @kaa.rpc.expose()
+    @metrics.measure
+    def epg_end(self, id, count, channels=None):
+        """
+        Finish the epg upload after count chunks
+        """
+        if not self._ingest or self._ingest.id != id:
+            raise ValueError('unknown epg upload %s' % id)
+        ingest, self._ingest = self._ingest, None
+        return ingest.finish(count, channels)
+
+    @kaa.rpc.expose()
+    @metrics.measure
+    @kaa.coroutine()
     def epg(self, (backend, data)):
-        kaa.epg.update(backend, data)
+        result = kaa.epg.update(backend, compress.unwrap(data))
+        if isinstance(result, kaa.InProgress):
+            yield result
+        # mark epg as changed for the next favorite check
+        epg.changed()
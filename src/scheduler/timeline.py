@@ -0,0 +1,254 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# timeline.py - in-memory EPG cache for the scheduler
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# The scheduler keeps the channels and the programs of the next days
+# (config.epg.horizon) in memory to avoid database queries for each
+# check. The programs of each channel are sorted by start time with the
+# start and stop times in arrays for bisect lookups. The cache is
+# dropped when the EPG changes and loaded again on the next access.
+#
+# -----------------------------------------------------------------------------
+# TVServer - A generic TV device wrapper and scheduler
+# Copyright (C) 2009 Dirk Meyer, et al.
+#
+# First Edition: Dirk Meyer <dischi@freevo.org>
+# Maintainer:    Dirk Meyer <dischi@freevo.org>
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'get_channel', 'get_channel_by_tuner_id', 'get_channels', 'channels_loaded',
+            'get_programs', 'invalidate' ]
+
+# python imports
+import time
+import array
+import bisect
+import logging
+
+# kaa imports
+import kaa
+import kaa.epg
+
+# tvserver imports
+from config import config
+
+# get logging object
+log = logging.getLogger('tvserver')
+
+# the channels and programs are loaded again after this time even if
+# no EPG change was noticed and to move the horizon
+RELOAD_INTERVAL = 6 * 60 * 60
+
+class Channel(object):
+    """
+    Programs of one channel sorted by start time
+    """
+    def __init__(self, name, programs):
+        self.name = name
+        self.programs = sorted(programs, key=lambda p: p.start_timestamp)
+        self.starts = array.array('l', [ p.start_timestamp for p in self.programs ])
+        self.stops = array.array('l', [ p.stop_timestamp for p in self.programs ])
+        # longest program, programs starting that much before a time
+        # may still be running
+        self.maxlen = 0
+        if self.programs:
+            self.maxlen = max([ stop - start for start, stop in zip(self.starts, self.stops) ])
+        self._titles = None
+
+    def get(self, start, stop):
+        """
+        Return the programs running between start and stop
+        """
+        first = bisect.bisect_left(self.starts, start - self.maxlen)
+        last = bisect.bisect_left(self.starts, stop)
+        stops = self.stops
+        return [ self.programs[pos] for pos in range(first, last) if stops[pos] > start ]
+
+    def titles(self):
+        """
+        Return a dict of title to (starts, programs) with the programs
+        with that title sorted by start time.
+        """
+        if self._titles is None:
+            self._titles = {}
+            for pos, p in enumerate(self.programs):
+                starts, listing = self._titles.setdefault(p.title, ([], []))
+                starts.append(self.starts[pos])
+                listing.append(p)
+        return self._titles
+
+
+class Programs(object):
+    """
+    Programs of all channels between start and stop
+    """
+    def __init__(self, start, stop, listing):
+        self.start = start
+        self.stop = stop
+        self.loaded = time.time()
+        channels = {}
+        for p in listing:
+            channels.setdefault(p.channel.name, []).append(p)
+        self._channels = {}
+        for name, programs in channels.items():
+            self._channels[name] = Channel(name, programs)
+        self._titles = None
+
+    def __len__(self):
+        return sum([ len(c.programs) for c in self._channels.values() ])
+
+    def get_channel(self, name):
+        """
+        Return the programs of the channel
+        """
+        if not name in self._channels:
+            self._channels[name] = Channel(name, [])
+        return self._channels[name]
+
+    def get(self, start=None, stop=None):
+        """
+        Return the programs of all channels running between start and stop
+        """
+        start = start or self.start
+        stop = stop or self.stop
+        result = []
+        for channel in self._channels.values():
+            result.extend(channel.get(start, stop))
+        return result
+
+    def search(self, titles, start=None):
+        """
+        Return the programs with one of the given titles stopping after start
+        """
+        if self._titles is None:
+            self._titles = {}
+            for channel in self._channels.values():
+                for title, (starts, listing) in channel.titles().items():
+                    self._titles.setdefault(title, []).extend(listing)
+        start = start or self.start
+        result = []
+        for title in titles:
+            result.extend([ p for p in self._titles.get(title, []) if p.stop_timestamp > start ])
+        return result
+
+
+# channel name to channel and tuner id to channel and the load time
+_channels = None
+_tuner_ids = None
+_channels_loaded = 0
+
+# cached programs and the InProgress object while loading
+_programs = None
+_loading = None
+# incremented on each EPG change to detect a change while loading
+_generation = 0
+
+def _load_channels():
+    """
+    Load the channels if they are not loaded or too old
+    """
+    global _channels
+    global _tuner_ids
+    global _channels_loaded
+    if _channels is not None and time.time() - _channels_loaded < RELOAD_INTERVAL:
+        return
+    _channels = {}
+    _tuner_ids = {}
+    _channels_loaded = time.time()
+    for channel in kaa.epg.guide.get_channels():
+        _channels[channel.name] = channel
+        for tuner_id in channel.tuner_id:
+            _tuner_ids.setdefault(tuner_id, channel)
+
+def get_channels():
+    """
+    Return all EPG channels
+    """
+    _load_channels()
+    return _channels.values()
+
+def get_channel(name):
+    """
+    Return the EPG channel with the given name or None
+    """
+    _load_channels()
+    return _channels.get(name)
+
+def get_channel_by_tuner_id(tuner_id):
+    """
+    Return the EPG channel with the given tuner id or None
+    """
+    _load_channels()
+    return _tuner_ids.get(tuner_id)
+
+def channels_loaded():
+    """
+    Return the time the current channels were loaded
+    """
+    _load_channels()
+    return _channels_loaded
+
+def get_programs():
+    """
+    Return the Programs object for the horizon. If the programs are not
+    loaded, an InProgress object is returned.
+    """
+    global _loading
+    if _loading is not None and _loading.finished:
+        _loading = None
+    if _programs is not None and time.time() - _programs.loaded < RELOAD_INTERVAL:
+        return _programs
+    if _loading is None:
+        _loading = _load_programs()
+        if _loading.finished:
+            return _loading.result
+    return _loading
+
+@kaa.coroutine()
+def _load_programs():
+    """
+    Load the programs for the horizon from the database
+    """
+    global _programs
+    generation = _generation
+    start = int(time.time())
+    stop = start + int(config.epg.horizon)
+    listing = kaa.epg.search(time=(start, stop))
+    if isinstance(listing, kaa.InProgress):
+        listing = yield listing
+    programs = Programs(start, stop, listing)
+    log.info('loaded %s programs for the epg cache', len(programs))
+    if generation == _generation:
+        _programs = programs
+    yield programs
+
+def invalidate():
+    """
+    Drop the cache after the EPG changed. It is called for each update
+    of the kaa.epg database noticed by epg.poll and device uploads.
+    """
+    global _channels
+    global _tuner_ids
+    global _programs
+    global _generation
+    _channels = _tuner_ids = _programs = None
+    _generation += 1
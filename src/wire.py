@@ -0,0 +1,193 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# wire.py - compact encoding of lists for the client sync
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# A list of tuples, e.g. the recordings from Recording.to_list, is sent
+# as list of columns instead of one tuple for each item. Columns with
+# only a few different values like the channel name are interned: the
+# column is a table of the values and the index in that table for each
+# item.
+#
+# The compact encoding of recordings is negotiated with the capabilities
+# RPC. Each message has a string table for the channel names and the
+# info keys. A recording is a fixed list of fields with the channel as
+# index in the table, the status as integer code and the info dict as
+# flat list of key index and value.
+#
+# -----------------------------------------------------------------------------
+# TVServer - A generic TV device wrapper and scheduler
+# Copyright (C) 2009 Dirk Meyer, et al.
+#
+# First Edition: Dirk Meyer <dischi@freevo.org>
+# Maintainer:    Dirk Meyer <dischi@freevo.org>
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'encode', 'decode', 'encode_recordings', 'decode_recordings', 'Encoder',
+            'RecordingEncoder', 'RECORDING_INTERNED', 'ENCODINGS' ]
+
+# interned columns of Recording.to_list: channel and status
+RECORDING_INTERNED = (2, 6)
+
+# encodings for the recordings, the first is the preferred one
+ENCODINGS = [ 'compact', 'tuple' ]
+
+# status values of the recordings, the position is the status code
+STATUS = [ 'missed', 'saved', 'scheduled', 'recording', 'conflict', 'deleted', 'failed' ]
+STATUS_CODE = dict([ (status, code) for code, status in enumerate(STATUS) ])
+
+def _intern(value, table, index):
+    if not value in index:
+        index[value] = len(table)
+        table.append(value)
+    return index[value]
+
+class Encoder(object):
+    """
+    Incremental encode, the rows can be added in several parts
+    """
+    def __init__(self, interned=()):
+        self.interned = interned
+        self.count = 0
+        self.columns = None
+        # value to table position for the interned columns
+        self._index = {}
+
+    def add(self, rows):
+        """
+        Add a list of tuples
+        """
+        if not rows:
+            return
+        if self.columns is None:
+            self.columns = []
+            for pos in range(len(rows[0])):
+                if pos in self.interned:
+                    self._index[pos] = {}
+                    self.columns.append(([], []))
+                else:
+                    self.columns.append([])
+        for pos, column in enumerate(zip(*rows)):
+            if pos in self.interned:
+                table, values = self.columns[pos]
+                index = self._index[pos]
+                for value in column:
+                    values.append(_intern(value, table, index))
+            else:
+                self.columns[pos].extend(column)
+        self.count += len(rows)
+
+    def result(self):
+        """
+        Return the result of encode for all added rows
+        """
+        if not self.count:
+            return 0, []
+        return self.count, self.columns
+
+
+def encode(rows, interned=()):
+    """
+    Encode a list of tuples as (count, columns). The columns at the
+    positions in interned are encoded as (table, indexes).
+    """
+    encoder = Encoder(interned)
+    encoder.add(rows)
+    return encoder.result()
+
+def decode((count, columns), interned=()):
+    """
+    Decode the result of encode into a list of tuples
+    """
+    if not count:
+        return []
+    decoded = []
+    for pos, column in enumerate(columns):
+        if pos in interned:
+            table, values = column
+            column = [ table[value] for value in values ]
+        decoded.append(column)
+    return zip(*decoded)
+
+class RecordingEncoder(object):
+    """
+    Incremental encode_recordings, the recordings can be added in
+    several parts
+    """
+    def __init__(self, encoding='tuple'):
+        self.encoding = encoding
+        self.channels, self._channel_index = [], {}
+        self.keys, self._key_index = [], {}
+        self.records = []
+
+    def add(self, recordings):
+        """
+        Add a list of recordings from Recording.to_list
+        """
+        if self.encoding != 'compact':
+            self.records.extend(recordings)
+            return
+        for id, name, channel, priority, start, stop, status, start_padding, stop_padding, info \
+                in recordings:
+            flat = []
+            for key, value in info.items():
+                flat.append(_intern(key, self.keys, self._key_index))
+                flat.append(value)
+            self.records.append((id, name, _intern(channel, self.channels, self._channel_index),
+                                 priority, start, stop, STATUS_CODE.get(status, status),
+                                 start_padding, stop_padding, flat))
+
+    def result(self):
+        """
+        Return the result of encode_recordings for all added recordings
+        """
+        if self.encoding != 'compact':
+            return self.records
+        return self.channels, self.keys, self.records
+
+
+def encode_recordings(recordings, encoding='tuple'):
+    """
+    Encode a list of recordings from Recording.to_list. The tuple
+    encoding returns the list unchanged, the compact encoding returns
+    (channels, keys, records).
+    """
+    if encoding != 'compact':
+        return recordings
+    encoder = RecordingEncoder(encoding)
+    encoder.add(recordings)
+    return encoder.result()
+
+def decode_recordings(data, encoding='tuple'):
+    """
+    Decode the result of encode_recordings to a list of tuples
+    """
+    if encoding != 'compact':
+        return data
+    channels, keys, records = data
+    recordings = []
+    for id, name, channel, priority, start, stop, status, start_padding, stop_padding, flat in records:
+        if isinstance(status, int):
+            status = STATUS[status]
+        info = dict([ (keys[flat[pos]], flat[pos + 1]) for pos in range(0, len(flat), 2) ])
+        recordings.append((id, name, channels[channel], priority, start, stop, status,
+                           start_padding, stop_padding, info))
+    return recordings
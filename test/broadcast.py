@@ -0,0 +1,108 @@
+import sys
+import time
+import cPickle
+
+import kaa
+import kaa.rpc
+
+from tvserver.scheduler.client import Client, QUEUE_SIZE
+from tvserver.scheduler.broadcast import Broadcast
+
+ADDRESS = '127.0.0.1:7651'
+
+# number of simulated clients and updates
+CLIENTS = 100
+UPDATES = 50
+
+class Receiver(object):
+    """
+    Simulated client counting the updates
+    """
+    def __init__(self):
+        self.received = 0
+        self.resyncs = 0
+
+    @kaa.rpc.expose('recording_update')
+    def recording_update(self, *args):
+        self.received += 1
+
+    @kaa.rpc.expose('packed')
+    def packed(self, name, data):
+        cPickle.loads(data)
+        self.received += 1
+
+    @kaa.rpc.expose('resync')
+    def resync(self):
+        self.resyncs += 1
+
+
+@kaa.coroutine()
+def wait(receivers, count):
+    """
+    Wait until the receivers got count messages
+    """
+    while sum([ r.received for r in receivers ]) < count:
+        yield kaa.delay(0.001)
+
+
+@kaa.coroutine()
+def drain(clients):
+    """
+    Wait until the send queues of the clients are not more than half
+    full. Without this the queues overflow and the updates are dropped.
+    """
+    while [ c for c in clients if len(c.queue) > QUEUE_SIZE / 2 ]:
+        yield kaa.NotFinished
+
+
+@kaa.coroutine()
+def main():
+    server = kaa.rpc.Server(ADDRESS, '')
+    clients = []
+    server.signals['client-connected'].connect(lambda c: clients.append(Client(c)))
+    receivers = []
+    for i in range(CLIENTS):
+        receivers.append(Receiver())
+        kaa.rpc.connect(ADDRESS, '').register(receivers[-1])
+    while len(clients) < CLIENTS:
+        yield kaa.delay(0.01)
+    for c in clients:
+        c.version = 0
+        c.legacy = False
+    t = int(time.time())
+    upserts = [ (id, u'recording %s' % id, u'Das Erste', 50, t + id * 3600, t + id * 3600 + 1800,
+                 'scheduled', 0, 0, { 'description': u'x' * 200 }) for id in range(20) ]
+
+    # one rpc per client and update
+    t0 = time.time()
+    for version in range(1, UPDATES + 1):
+        for c in clients:
+            c.channel.rpc('recording_update', version, upserts, [], version - 1)
+    yield wait(receivers, CLIENTS * UPDATES)
+    print 'rpc per client:        %d messages in %.3f sec' % (CLIENTS * UPDATES, time.time() - t0)
+
+    # broadcast without batching
+    for r in receivers:
+        r.received = 0
+    broadcast = Broadcast(clients)
+    t0 = time.time()
+    for version in range(1, UPDATES + 1):
+        broadcast.recordings(version, upserts, [])
+        broadcast.flush()
+        yield drain(clients)
+    yield wait(receivers, CLIENTS * UPDATES)
+    print 'broadcast:             %d messages in %.3f sec' % (CLIENTS * UPDATES, time.time() - t0)
+
+    # broadcast with batching
+    for r in receivers:
+        r.received = 0
+    t0 = time.time()
+    for version in range(UPDATES + 1, 2 * UPDATES + 1):
+        broadcast.recordings(version, upserts, [])
+    yield wait(receivers, CLIENTS)
+    print 'broadcast with batch:  %d messages in %.3f sec' % (CLIENTS, time.time() - t0)
+    print 'resyncs:               %d' % sum([ r.resyncs for r in receivers ])
+    sys.exit(0)
+
+main()
+kaa.main.run()
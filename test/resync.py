@@ -0,0 +1,156 @@
+import sys
+import time
+import logging
+
+import kaa
+import kaa.rpc
+
+from tvserver.rpc import TVServer
+from tvserver.scheduler.changelog import ChangeLog
+from tvserver import wire
+
+ADDRESS = '127.0.0.1:7650'
+
+failed = 0
+
+def check(name, result):
+    global failed
+    if not result:
+        failed += 1
+    print '%-50s %s' % (name, result and 'ok' or 'FAILED')
+
+
+class Recording(object):
+    """
+    Stand-in for the server recording
+    """
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.start = int(time.time()) + 3600 * id
+
+    def to_list(self):
+        return self.id, self.name, u'Das Erste', 50, self.start, self.start + 1800, \
+               'scheduled', 0, 0, {}
+
+
+class Server(object):
+    """
+    Stand-in for the tvserver with the recording sync API
+    """
+    def __init__(self):
+        self.recordings = [ Recording(id, u'recording %s' % id) for id in range(10) ]
+        self.changelog = ChangeLog(size=5)
+        self.changelog.update(self.recordings)
+        self.clients = []
+        # versions sent by the clients in recording_sync
+        self.syncs = []
+        self._rpc = kaa.rpc.Server(ADDRESS, '')
+        self._rpc.signals['client-connected'].connect(self.client_connected)
+        self._rpc.register(self)
+
+    def client_connected(self, client):
+        self.clients.append(client)
+        client.signals['closed'].connect(self.clients.remove, client)
+
+    def change(self, send=True):
+        changes = self.changelog.update(self.recordings)
+        if changes and send:
+            for c in self.clients:
+                c.rpc('recording_update', *changes)
+
+    def disconnect(self):
+        for c in self.clients[:]:
+            c.close()
+
+    @kaa.rpc.expose()
+    def recording_sync(self, epoch=None, version=None):
+        self.syncs.append(version)
+        changes = None
+        if epoch is not None:
+            changes = self.changelog.since(epoch, version)
+        epoch, version = self.changelog.epoch, self.changelog.version
+        if changes is None:
+            return epoch, version, True, [ r.to_list() for r in self.recordings ], []
+        return epoch, version, False, changes[0], changes[1]
+
+    @kaa.rpc.expose()
+    def snapshot(self, epoch=None, version=None):
+        epoch, version, full, upserts, deletes = self.recording_sync(epoch, version)
+        return { 'epoch': epoch, 'version': version, 'full': full,
+                 'recordings': wire.encode(upserts, wire.RECORDING_INTERNED),
+                 'deletes': deletes, 'favorites': wire.encode([]), 'devices': [] }
+
+
+def test_changelog():
+    recordings = [ Recording(id, u'recording %s' % id) for id in range(3) ]
+    log = ChangeLog(size=3)
+    check('first version contains all', log.update(recordings)[1:] == \
+          ([ r.to_list() for r in recordings ], []))
+    check('no version without changes', log.update(recordings) is None)
+    recordings[0].name = u'changed'
+    check('modified recording', log.update(recordings) == (2, [ recordings[0].to_list() ], []))
+    recordings.pop()
+    check('removed recording', log.update(recordings) == (3, [], [ 2 ]))
+    check('changes since version 1', log.since(log.epoch, 1) == ([ recordings[0].to_list() ], [ 2 ]))
+    check('no changes for current version', log.since(log.epoch, 3) == ([], []))
+    check('unknown epoch', log.since(log.epoch - 1, 3) is None)
+    check('unknown version', log.since(log.epoch, 4) is None)
+    recordings[1].name = u'changed'
+    log.update(recordings)
+    check('version not in log', log.since(log.epoch, 0) is None)
+
+
+@kaa.coroutine()
+def test_client():
+    server = Server()
+    client = TVServer(ADDRESS, '')
+    yield client.signals.subset('connected').any()
+    check('full sync on connect', server.syncs == [ None ] and len(list(client.recordings)) == 10)
+
+    # broadcast in order
+    server.recordings[0].name = u'changed'
+    server.change()
+    yield kaa.delay(0.2)
+    r = [ r for r in client.recordings if r.id == 0 ][0]
+    check('update applied', r.name == u'changed' and client._version == server.changelog.version)
+
+    # missed version
+    server.recordings.pop()
+    server.change(send=False)
+    server.recordings[0].name = u'changed again'
+    server.change()
+    yield kaa.delay(0.2)
+    check('sync after missed update', server.syncs[-1] == server.changelog.version - 2 and \
+          len(list(client.recordings)) == 9)
+
+    # reconnect with the version in the log
+    connected = client.signals.subset('connected').any()
+    server.disconnect()
+    server.recordings.pop()
+    server.change()
+    yield connected
+    check('delta sync on reconnect', server.syncs[-1] == server.changelog.version - 1 and \
+          len(list(client.recordings)) == 8)
+
+    # reconnect with the version not in the log anymore
+    connected = client.signals.subset('connected').any()
+    server.disconnect()
+    for i in range(6):
+        server.recordings[0].name = u'change %s' % i
+        server.change()
+    yield connected
+    check('full sync on reconnect', server.changelog.since(client._epoch, server.syncs[-1]) is None and \
+          len(list(client.recordings)) == 8 and client._version == server.changelog.version)
+
+
+@kaa.coroutine()
+def main():
+    test_changelog()
+    yield test_client()
+    sys.exit(failed)
+
+logging.getLogger().setLevel(logging.INFO)
+
+main()
+kaa.main.run()
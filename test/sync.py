@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+
+import kaa
+import kaa.rpc
+
+from tvserver.scheduler.config import config
+from tvserver.scheduler.recording import Recording
+from tvserver.scheduler.rpc import RPCServer
+from tvserver.scheduler import dispatch
+
+ADDRESS = '127.0.0.1:7652'
+
+failed = 0
+
+def check(name, result):
+    global failed
+    if not result:
+        failed += 1
+    print '%-50s %s' % (name, result and 'ok' or 'FAILED')
+
+
+class Receiver(object):
+    """
+    Client side of the channel, the server broadcasts updates to it
+    """
+    @kaa.rpc.expose('packed')
+    def packed(self, name, data):
+        pass
+
+
+def names(upserts):
+    return dict([ (r[0], r[1]) for r in upserts ])
+
+
+@kaa.coroutine()
+def main():
+    tmpdir = tempfile.mkdtemp(prefix='tvserver-test-')
+    config.epg.database = os.path.join(tmpdir, 'epg.db')
+    server = RPCServer(os.path.join(tmpdir, 'recordings.xml'))
+
+    # local client connected to the server through kaa.rpc
+    rpc = kaa.rpc.Server(ADDRESS, '')
+    channels = []
+    rpc.signals['client-connected'].connect(channels.append)
+    kaa.rpc.connect(ADDRESS, '').register(Receiver())
+    while not channels:
+        yield kaa.delay(0.01)
+    channel = channels[0]
+
+    t = int(time.time()) + 24 * 60 * 60
+    for id in range(10):
+        channel_name = id % 2 and u'ZDF' or u'Das Erste'
+        server.recordings.append(Recording(u'recording %s' % id, channel_name, 50,
+                                           t + id * 3600, t + id * 3600 + 1800))
+    yield server.reschedule()
+
+    # full sync without a version
+    epoch, version, full, upserts, deletes = yield server._sync(channel, None, None)
+    client = server._get_client(channel)
+    check('full sync without version', full and len(upserts) == 10 and not deletes)
+    check('client has synced version', client.version == version == server._changelog.version)
+
+    # delta sync after a change
+    server.recordings[0].name = u'changed'
+    server.recordings.pop()
+    epoch, version2, full, upserts, deletes = yield server._sync(channel, epoch, version)
+    check('delta sync after change', not full and names(upserts) == { server.recordings[0].id: u'changed' } \
+          and len(deletes) == 1 and version2 == version + 1)
+    epoch, version, full, upserts, deletes = yield server._sync(channel, epoch, version2)
+    check('empty delta for current version', not full and upserts == [] and deletes == [])
+
+    # full sync for unknown versions
+    epoch2, version, full, upserts, deletes = yield server._sync(channel, epoch - 1, version)
+    check('full sync for unknown epoch', full and len(upserts) == 9)
+
+    # filtered clients always get a full sync with their recordings
+    client.subscribe(channels=[ u'ZDF' ])
+    epoch, version, full, upserts, deletes = yield server._sync(channel, epoch, version)
+    check('full sync for filtered client', full and len(upserts) == 4 and \
+          not [ r for r in upserts if r[2] != u'ZDF' ])
+    check('filtered client knows its ids', client.ids == set([ r[0] for r in upserts ]))
+    client.subscribe()
+
+    # change a recording already converted while the sync runs
+    conversions = []
+    to_lists = dispatch.to_lists
+    def count_lists(objects):
+        conversions.append(len(objects))
+        return to_lists(objects)
+    dispatch.to_lists = count_lists
+    dispatch.CHUNK = 2
+    sync = server._sync(channel, None, None)
+    server.recordings[0].name = u'changed during sync'
+    epoch, version, full, upserts, deletes = yield sync
+    dispatch.to_lists = to_lists
+    check('sync starts again after change', len(conversions) == 2)
+    check('sync matches its version', version == server._changelog.version and \
+          names(upserts)[server.recordings[0].id] == u'changed during sync')
+
+    # change a recording while the reply is encoded, the update is not
+    # sent to the client and the sync starts again
+    encoded = []
+    encode_recordings = dispatch.encode_recordings
+    def change_once(recordings, encoding):
+        if not encoded:
+            server.recordings[0].name = u'changed during encode'
+        encoded.append(len(recordings))
+        return encode_recordings(recordings, encoding)
+    dispatch.encode_recordings = change_once
+    epoch, version, full, upserts, deletes = yield server.recording_sync(channel, None, None)
+    dispatch.encode_recordings = encode_recordings
+    check('sync reply starts again after change', len(encoded) == 2 and not client.syncing)
+    check('sync reply matches its version', version == client.version == server._changelog.version \
+          and names(upserts)[server.recordings[0].id] == u'changed during encode')
+
+    shutil.rmtree(tmpdir)
+    sys.exit(failed)
+
+logging.getLogger().setLevel(logging.INFO)
+
+main()
+kaa.main.run()